@@ -15,6 +15,7 @@ DATA_DIR = path.join(HOME, 'DATA')
 USER_DIR = path.join(HOME, '.baecc')
 RESULTS_DIR = path.join(HOME, 'results')
 H5_PATH = path.join(DATA_DIR, 'baecc.h5')
+ARCHIVE_PATH = path.join(DATA_DIR, 'baecc_archive') # partitioned by day
 
 # constants
 if CGS_UNITS:
@@ -1,20 +1,83 @@
 # coding: utf-8
 import os
+import sys
+import json
+import time
+import shutil
+import argparse
 import warnings
 import pickle
 import hashlib
+import re
+import uuid
+from contextlib import contextmanager
+from glob import glob
+import numpy as np
 import pandas as pd
 from j24 import home, ensure_dir
+try:
+    import pyarrow as pa
+except ImportError:
+    pa = None
+try:
+    import fcntl
+except ImportError: # no file locking on this platform
+    fcntl = None
+try:
+    from tables import HDF5ExtError
+except ImportError: # no hdf support, nothing to catch
+    HDF5ExtError = ()
 
-MSGTLD = '.msg'
 PICKLETLD = '.pkl'
+NPZTLD = '.npz'
+ARROWTLD = '.arrow'
 CACHE_DIR = os.path.join(home(), '.cache', 'baecc')
+# Increment when cached products change to have old entries recomputed.
+CACHE_VERSION = 2
+# byte budget of CACHE_DIR, enforced by evicting least recently used
+# fingerprint directories; None for no limit
+CACHE_MAX_BYTES = 10*2**30
+PRUNE_INTERVAL = 600 # minimum seconds between automatic prunes
+ACCESS_MARKER = '.access'
+LOCKTLD = '.lock'
+TEMP_RE = re.compile(r'\.[0-9a-f]{32}\.tmp')
+_last_prune = 0
+# per product cache statistics of this process
+STATS_COLS = ['hits', 'memo_hits', 'misses', 'uncached', 'computes',
+              'read_time', 'compute_time', 'write_time', 'bytes_read',
+              'bytes_written']
+_product_stats = {}
 
 
 def fingerprint(string):
     return hashlib.sha256(string.encode('utf-8')).hexdigest()[-12:]
 
 
+def _hash_values(h, values):
+    values = np.asarray(values)
+    if values.dtype == object:
+        h.update(str(values.tolist()).encode('utf-8'))
+        return
+    h.update((str(values.dtype) + str(values.shape)).encode('utf-8'))
+    h.update(np.ascontiguousarray(values).reshape(-1).view(np.uint8))
+
+
+def hash_frame(data):
+    """content hash of a DataFrame or Series
+
+    Index, column labels and values are hashed directly from their numpy
+    buffers. Object arrays fall back to their full string representation."""
+    if isinstance(data, pd.Series):
+        data = data.to_frame()
+    h = hashlib.blake2b(digest_size=16)
+    _hash_values(h, data.index.values)
+    h.update(str(list(data.index.names)).encode('utf-8'))
+    for col, values in data.items():
+        h.update(str(col).encode('utf-8'))
+        _hash_values(h, values.values)
+    return h.hexdigest()
+
+
 def hash_dict(d):
     return fingerprint(str(sorted(d.items())))
 
@@ -23,6 +86,440 @@ def combine2str(*identifiers):
     return ''.join(tuple(map(str, identifiers)))
 
 
+class PickleBackend:
+    """cache entries of arbitrary objects as pickles"""
+    ext = PICKLETLD
+
+    def read(self, filename):
+        with open(filename, 'rb') as cachefile:
+            return pickle.load(cachefile)
+
+    def write(self, filename, data):
+        with open(filename, 'wb') as cachefile:
+            pickle.dump(data, cachefile, pickle.HIGHEST_PROTOCOL)
+
+
+class NpzBackend:
+    """cache entries of Series and DataFrames as numpy arrays in npz files"""
+    ext = NPZTLD
+
+    def read(self, filename):
+        with np.load(filename, allow_pickle=True) as f:
+            meta = f['meta'][0]
+            if len(meta['index_names']) > 1:
+                index = pd.MultiIndex.from_tuples(f['index'],
+                                                  names=meta['index_names'])
+            else:
+                index = pd.Index(f['index'], name=meta['index_names'][0])
+            columns = [f['c{0}'.format(i)] for i in range(len(meta['columns']))]
+        data = pd.DataFrame(dict(enumerate(columns)), index=index)
+        data.columns = meta['columns']
+        if meta['series']:
+            series = data.iloc[:, 0]
+            if meta.get('unnamed', False):
+                series.name = None
+            return series
+        return data
+
+    def write(self, filename, data):
+        series = isinstance(data, pd.Series)
+        unnamed = series and data.name is None
+        if series:
+            data = data.to_frame()
+        meta = {'series': series, 'unnamed': unnamed,
+                'columns': list(data.columns),
+                'index_names': list(data.index.names),
+                'version': CACHE_VERSION}
+        arrays = {'c{0}'.format(i): data.iloc[:, i].values
+                  for i in range(data.shape[1])}
+        np.savez(filename, meta=np.array([meta], dtype=object),
+                 index=data.index.values, **arrays)
+
+
+class ArrowBackend:
+    """cache entries of Series and DataFrames as Arrow IPC (Feather) files
+
+    Files are memory-mapped when read, so columns are not copied where the
+    data types allow it. Such columns are read-only, unlike freshly computed
+    data, so copy data read from the cache before modifying it in place."""
+    ext = ARROWTLD
+
+    def __init__(self):
+        if pa is None:
+            raise ImportError('pyarrow is needed for Arrow cache entries.')
+
+    def read(self, filename):
+        table = pa.ipc.open_file(pa.memory_map(filename, 'r')).read_all()
+        meta = json.loads(table.schema.metadata[b'baecc'].decode('utf-8'))
+        data = table.to_pandas(split_blocks=True)
+        if meta['series']:
+            series = data.iloc[:, 0]
+            if meta['unnamed']:
+                series.name = None
+            return series
+        return data
+
+    def write(self, filename, data):
+        series = isinstance(data, pd.Series)
+        unnamed = series and data.name is None
+        if series:
+            data = data.to_frame()
+        table = pa.Table.from_pandas(data)
+        meta = json.dumps({'series': series, 'unnamed': unnamed,
+                           'version': CACHE_VERSION})
+        metadata = dict(table.schema.metadata or {})
+        metadata[b'baecc'] = meta.encode('utf-8')
+        table = table.replace_schema_metadata(metadata)
+        with pa.OSFile(filename, 'wb') as sink:
+            with pa.ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table)
+
+
+BACKENDS = {backend.ext: backend for backend in (PickleBackend, NpzBackend,
+                                                 ArrowBackend)}
+
+
+def table_backend():
+    """default cache backend for Series and DataFrames"""
+    if pa is None:
+        return NpzBackend()
+    return ArrowBackend()
+
+
+def entry_path(basepath, backend=None):
+    """path of a cache entry tagged with format and cache version"""
+    if backend is None:
+        backend = table_backend()
+    return '{0}.v{1}{2}'.format(basepath, CACHE_VERSION, backend.ext)
+
+
+def read_entry(filename):
+    """Read a cache entry using the backend matching its extension."""
+    return BACKENDS[os.path.splitext(filename)[1]]().read(filename)
+
+
+def temp_path(filename):
+    """unique temporary file name next to filename, with the same extension"""
+    root, ext = os.path.splitext(filename)
+    return '{0}.{1}.tmp{2}'.format(root, uuid.uuid4().hex, ext)
+
+
+def atomic_write(filename, writer):
+    """Write a file via writer(path) to a temporary file and rename it.
+
+    Readers see either the old or the new complete file."""
+    tmp = temp_path(filename)
+    try:
+        writer(tmp)
+        os.replace(tmp, filename)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+
+@contextmanager
+def entry_lock(filename):
+    """exclusive inter-process lock for a cache entry
+
+    Lock files are left in place and only removed by prune and clear while
+    holding them. If the lock file is removed while waiting for it, the lock
+    is taken again on a new lock file."""
+    lockpath = filename + LOCKTLD
+    while True:
+        ensure_dir(os.path.dirname(lockpath))
+        lockfile = open(lockpath, 'a')
+        if fcntl is None or same_file(lockfile, lockpath):
+            break
+        lockfile.close()
+    try:
+        yield
+    finally:
+        lockfile.close() # releases the lock
+
+
+def same_file(lockfile, lockpath):
+    """Lock lockfile and check that it is still found at lockpath."""
+    fcntl.flock(lockfile, fcntl.LOCK_EX)
+    try:
+        return os.fstat(lockfile.fileno()).st_ino == os.stat(lockpath).st_ino
+    except OSError:
+        return False
+
+
+@contextmanager
+def dir_locks(dirpath):
+    """Try to take all entry locks in a directory tree without waiting.
+
+    Yield whether none of them was held by another process."""
+    lockfiles = []
+    free = True
+    try:
+        for lockpath in glob(os.path.join(dirpath, '**', '*' + LOCKTLD),
+                             recursive=True):
+            try:
+                lockfile = open(lockpath, 'a')
+            except OSError: # removed meanwhile
+                continue
+            lockfiles.append(lockfile)
+            if fcntl is None:
+                continue
+            try:
+                fcntl.flock(lockfile, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                free = False
+                break
+        yield free
+    finally:
+        for lockfile in lockfiles:
+            lockfile.close()
+
+
+def writing(dirpath, max_age=PRUNE_INTERVAL):
+    """Whether a directory tree has temporary files modified within max_age
+    seconds, i.e. entries being written."""
+    now = time.time()
+    for root, dirs, files in os.walk(dirpath):
+        for f in files:
+            if not TEMP_RE.search(f):
+                continue
+            try:
+                if now - os.path.getmtime(os.path.join(root, f)) < max_age:
+                    return True
+            except OSError: # renamed or removed meanwhile
+                continue
+    return False
+
+
+def remove_corrupt(filename, err):
+    """Warn about and remove an unreadable cache entry."""
+    warnings.warn('Removing corrupt cache entry {0}: {1}'.format(filename, err))
+    try:
+        os.remove(filename)
+    except OSError:
+        pass
+
+
+def read_valid(backend, filename):
+    """Read a cache entry. Return whether it was read and the data.
+
+    Missing entries and corrupt entries, which are removed, are not read."""
+    if not os.path.isfile(filename):
+        return False, None
+    try:
+        return True, backend.read(filename)
+    except Exception as err:
+        remove_corrupt(filename, err)
+        return False, None
+
+
+def product_name(name):
+    """product name without the parameter fingerprint suffix"""
+    return re.sub('[0-9a-f]{12}$', '', name) or name
+
+
+def data_bytes(data, filename=None):
+    """in-memory size of a Series or DataFrame, or size of filename for
+    other objects"""
+    if isinstance(data, pd.Series):
+        return int(data.memory_usage())
+    if isinstance(data, pd.DataFrame):
+        return int(data.memory_usage().sum())
+    if filename is not None:
+        return os.path.getsize(filename)
+    return 0
+
+
+def record(name, **increments):
+    """Add to cache statistics of a product."""
+    stats = _product_stats.setdefault(product_name(name),
+                                      dict.fromkeys(STATS_COLS, 0))
+    for key, value in increments.items():
+        stats[key] += value
+
+
+def product_stats():
+    """cache hits, misses, timings in seconds and bytes per product
+
+    Bytes are in-memory sizes of Series and DataFrames and file sizes of
+    other cached objects. Statistics are collected in the current process
+    only."""
+    stats = pd.DataFrame.from_dict(_product_stats, orient='index',
+                                   columns=STATS_COLS)
+    stats.index.name = 'product'
+    return stats.sort_index()
+
+
+def reset_product_stats():
+    _product_stats.clear()
+
+
+def product_report(filename=None):
+    """Summarize product cache statistics, optionally saving them as csv.
+
+    Mean read and compute times show which products are worth caching."""
+    stats = product_stats()
+    reads = stats['hits'] + stats['misses']
+    stats['hit_rate'] = stats['hits']/reads.where(reads > 0)
+    stats['mean_read'] = stats['read_time']/stats['hits'].where(stats['hits'] > 0)
+    computes = stats['computes']
+    stats['mean_compute'] = stats['compute_time']/computes.where(computes > 0)
+    if filename is not None:
+        stats.to_csv(filename)
+    return stats.to_string()
+
+
+def touch(dirpath):
+    """Mark a cache directory accessed, at most once per PRUNE_INTERVAL."""
+    marker = os.path.join(dirpath, ACCESS_MARKER)
+    try:
+        if time.time() - os.path.getmtime(marker) < PRUNE_INTERVAL:
+            return
+    except OSError: # not marked yet
+        pass
+    with open(marker, 'a'):
+        os.utime(marker, None)
+
+
+def dir_usage(dirpath):
+    """Return size in bytes, number of files and last access time of a
+    directory tree, or None if the directory was removed meanwhile."""
+    size = 0
+    nfiles = 0
+    try:
+        last_access = os.path.getmtime(dirpath)
+    except OSError:
+        return None
+    for root, dirs, files in os.walk(dirpath):
+        for f in files:
+            try:
+                st = os.stat(os.path.join(root, f))
+            except OSError: # lock or temporary file removed meanwhile
+                continue
+            if f == ACCESS_MARKER:
+                last_access = max(last_access, st.st_mtime)
+                continue
+            size += st.st_size
+            nfiles += 1
+    return size, nfiles, last_access
+
+
+def cache_stats(cache_dir=CACHE_DIR):
+    """Usage of fingerprint directories in cache_dir, least recent first."""
+    rows = {}
+    if os.path.isdir(cache_dir):
+        for name in os.listdir(cache_dir):
+            dirpath = os.path.join(cache_dir, name)
+            if not os.path.isdir(dirpath):
+                continue
+            usage = dir_usage(dirpath)
+            if usage is not None:
+                rows[name] = usage
+    stats = pd.DataFrame.from_dict(rows, orient='index',
+                                   columns=['bytes', 'files', 'last_access'])
+    stats.index.name = 'fingerprint'
+    stats['last_access'] = pd.to_datetime(stats['last_access'], unit='s')
+    return stats.sort_values('last_access')
+
+
+def prune(max_bytes=CACHE_MAX_BYTES, cache_dir=CACHE_DIR, keep=()):
+    """Remove least recently used fingerprint directories until the cache
+    fits in max_bytes. Return names of the removed directories.
+
+    Directories with entries being computed or written are skipped. Entry
+    locks are held while removing a directory."""
+    if max_bytes is None:
+        return []
+    stats = cache_stats(cache_dir)
+    total = stats['bytes'].sum()
+    removed = []
+    for name, row in stats.iterrows():
+        if total <= max_bytes:
+            break
+        dirpath = os.path.join(cache_dir, name)
+        if not os.path.isdir(dirpath): # removed by another process
+            total -= row['bytes']
+            continue
+        if name in keep or writing(dirpath):
+            continue
+        with dir_locks(dirpath) as free:
+            if not free:
+                continue
+            shutil.rmtree(dirpath, ignore_errors=True)
+        total -= row['bytes']
+        removed.append(name)
+    return removed
+
+
+def auto_prune(keep=()):
+    """prune at most once per PRUNE_INTERVAL"""
+    global _last_prune
+    now = time.time()
+    if now - _last_prune < PRUNE_INTERVAL:
+        return
+    _last_prune = now
+    prune(keep=keep)
+
+
+def clear(cache_dir=CACHE_DIR):
+    """Remove all cached data.
+
+    Directories with entry locks held by other processes are kept. Return
+    names of the kept directories."""
+    kept = []
+    if not os.path.isdir(cache_dir):
+        return kept
+    for name in os.listdir(cache_dir):
+        dirpath = os.path.join(cache_dir, name)
+        if not os.path.isdir(dirpath):
+            continue
+        with dir_locks(dirpath) as free:
+            if free:
+                shutil.rmtree(dirpath, ignore_errors=True)
+            else:
+                kept.append(name)
+    if len(kept) == 0:
+        shutil.rmtree(cache_dir, ignore_errors=True)
+    return kept
+
+
+def parse_bytes(size):
+    """Parse a byte count with optional K, M, G or T suffix."""
+    units = {'K': 2**10, 'M': 2**20, 'G': 2**30, 'T': 2**40}
+    size = size.strip().upper().rstrip('B')
+    if size and size[-1] in units:
+        return int(float(size[:-1])*units[size[-1]])
+    return int(size)
+
+
+def main(argv=None):
+    """cache management command line interface"""
+    parser = argparse.ArgumentParser(description='Manage the baecc cache.')
+    parser.add_argument('--cache-dir', default=CACHE_DIR)
+    sub = parser.add_subparsers(dest='command')
+    sub.required = True
+    sub.add_parser('stats', help='show cache usage per fingerprint')
+    prune_parser = sub.add_parser('prune',
+                                  help='evict least recently used entries')
+    prune_parser.add_argument('--max-bytes', type=parse_bytes,
+                              default=CACHE_MAX_BYTES,
+                              help='cache size budget, e.g. 5G')
+    sub.add_parser('clear', help='remove all cached data')
+    args = parser.parse_args(argv)
+    if args.command == 'stats':
+        stats = cache_stats(args.cache_dir)
+        print(stats.to_string())
+        print('total: {0} bytes in {1} files'.format(stats['bytes'].sum(),
+                                                     stats['files'].sum()))
+    elif args.command == 'prune':
+        removed = prune(args.max_bytes, cache_dir=args.cache_dir)
+        print('removed {0} directories'.format(len(removed)))
+    elif args.command == 'clear':
+        kept = clear(args.cache_dir)
+        if len(kept) > 0:
+            print('kept {0} directories in use'.format(len(kept)))
+    return 0
+
+
 class Cacher:
     """common methods to use msg cache"""
     def __init__(self, use_cache=True, storefilename='store.h5',
@@ -30,17 +527,32 @@ class Cacher:
         self.use_cache = use_cache
         self.storefilename = storefilename
         self.parent = parent
+        self._store_memo = {}
+        self._store_memo_path = None
+
+    # backend for msger, None for table_backend()
+    cache_backend = None
 
     def msger(self, name, func, **kwargs):
-        """Read from msgpack if caching is in use."""
+        """Read Series or DataFrame from cache if caching is in use.
+
+        Data read from Arrow entries may be read-only, see ArrowBackend."""
         if self.use_cache:
             return self.msg_io(name, func, **kwargs)
-        return func(**kwargs)
+        return self.uncached(name, func, **kwargs)
 
     def pickler(self, name, func, **kwargs):
         if self.use_cache:
             return self.pkl_io(name, func, **kwargs)
-        return func(**kwargs)
+        return self.uncached(name, func, **kwargs)
+
+    def uncached(self, name, func, **kwargs):
+        """Compute data without caching, recording the compute time."""
+        t0 = time.perf_counter()
+        data = func(**kwargs)
+        record(name, uncached=1, computes=1,
+               compute_time=time.perf_counter()-t0)
+        return data
 
     def cache_dir(self):
         """Return full path to cache directory."""
@@ -49,52 +561,156 @@ class Cacher:
         return os.path.join(CACHE_DIR, self.parent.fingerprint(),
                             self.fingerprint())
 
+    def cache_root(self):
+        """fingerprint directory in CACHE_DIR, the unit of cache eviction"""
+        return os.path.relpath(self.cache_dir(), CACHE_DIR).split(os.sep)[0]
+
+    def cache_accessed(self, written=False):
+        """Record access to the cache directory, pruning after writes."""
+        touch(self.cache_dir())
+        if written:
+            auto_prune(keep=(self.cache_root(),))
+
     def store_path(self):
         """Return full path to hdf store file."""
         return os.path.join(self.cache_dir(), self.storefilename)
 
+    def store_memo(self):
+        """Return in-memory copies of hdf store tables.
+
+        The copies are valid as long as the store path, and thus the
+        fingerprint, stays the same."""
+        storepath = self.store_path()
+        if storepath != self._store_memo_path:
+            self._store_memo = {}
+            self._store_memo_path = storepath
+        return self._store_memo
+
     def store_read(self, tablename, default_value=None, nocache_value=None):
-        """Read from hdf store if using caching."""
+        """Read from hdf store if using caching.
+
+        The store file is only opened if the table is not yet in memory. A
+        store that is not a valid hdf5 file is removed."""
         if self.use_cache:
+            memo = self.store_memo()
+            if tablename in memo:
+                data = memo[tablename]
+                if data is None: # known to be missing from the store
+                    return default_value
+                record(tablename, memo_hits=1)
+                return data
+            storepath = self.store_path()
             ensure_dir(self.cache_dir())
-            try:
-                with pd.HDFStore(self.store_path()) as store:
-                    return store.get(tablename)
-            except KeyError as err:
-                warnings.warn("KeyError: {0} Using default value.".format(err))
+            self.cache_accessed()
+            t0 = time.perf_counter()
+            data = None
+            with entry_lock(storepath):
+                try:
+                    if os.path.isfile(storepath):
+                        with pd.HDFStore(storepath, mode='r') as store:
+                            data = store.get(tablename)
+                except KeyError as err:
+                    warnings.warn("KeyError: {0} Using default value.".format(err))
+                except HDF5ExtError as err:
+                    remove_corrupt(storepath, err)
+            if data is None:
+                memo[tablename] = None
+                record(tablename, misses=1)
                 return default_value
+            record(tablename, hits=1, read_time=time.perf_counter()-t0,
+                   bytes_read=data_bytes(data))
+            memo[tablename] = data
+            return data
         return nocache_value
 
     def store_write(self, tablename, data):
-        """Write data to hdf store."""
+        """Write data to hdf store and its in-memory copy.
+
+        The store is updated in place while holding its lock, which readers
+        also take."""
+        memo = self.store_memo()
+        storepath = self.store_path()
         ensure_dir(self.cache_dir())
-        with pd.HDFStore(self.store_path()) as store:
+        t0 = time.perf_counter()
+        with entry_lock(storepath):
+            with pd.HDFStore(storepath) as store:
                 store[tablename] = data
+        record(tablename, write_time=time.perf_counter()-t0,
+               bytes_written=data_bytes(data))
+        memo[tablename] = data
+        self.cache_accessed(written=True)
 
-    def msg_io(self, name, func, **kwargs):
-        """Read data from msgpack. If not available, calculate and store."""
+    def store_compute(self, tablename, func, **kwargs):
+        """Compute and store tables by func unless tablename is stored.
+
+        Only one process computes a missing table, others wait for it and read
+        the result."""
+        if not self.use_cache:
+            self.uncached(tablename, func, **kwargs)
+            return
+        with entry_lock(os.path.join(self.cache_dir(), tablename)):
+            # tables may have been stored while waiting for the lock
+            memo = self.store_memo()
+            for name in [name for name in memo if memo[name] is None]:
+                del memo[name]
+            if self.store_read(tablename) is not None:
+                return
+            t0 = time.perf_counter()
+            func(**kwargs)
+            record(tablename, computes=1, compute_time=time.perf_counter()-t0)
+
+    def cache_io(self, name, func, backend, **kwargs):
+        """Read data from cache. If not available, calculate and store.
+
+        Only one process computes a missing entry, others wait for it and read
+        the result. Corrupt entries are removed and recomputed."""
         cd = self.cache_dir()
-        msgpath = os.path.join(cd, name + MSGTLD)
-        if os.path.isfile(msgpath):
-            data = pd.read_msgpack(msgpath)
-        else:
-            ensure_dir(cd)
+        filename = entry_path(os.path.join(cd, name), backend)
+        found, data = self.timed_read(name, backend, filename)
+        if found:
+            return data
+        ensure_dir(cd)
+        with entry_lock(filename):
+            # the entry may have been written while waiting for the lock
+            found, data = self.timed_read(name, backend, filename)
+            if found:
+                return data
+            t0 = time.perf_counter()
             data = func(**kwargs)
-            data.to_msgpack(msgpath)
+            t1 = time.perf_counter()
+            atomic_write(filename, lambda tmp: backend.write(tmp, data))
+            record(name, misses=1, computes=1, compute_time=t1-t0,
+                   write_time=time.perf_counter()-t1,
+                   bytes_written=data_bytes(data, filename))
+        self.cache_accessed(written=True)
         return data
 
+    def timed_read(self, name, backend, filename):
+        """read_valid recording a cache hit"""
+        t0 = time.perf_counter()
+        found, data = read_valid(backend, filename)
+        if found:
+            record(name, hits=1, read_time=time.perf_counter()-t0,
+                   bytes_read=data_bytes(data, filename))
+            self.cache_accessed()
+        return found, data
+
+    def msg_io(self, name, func, **kwargs):
+        """cache_io for Series and DataFrames"""
+        backend = self.cache_backend
+        if backend is None:
+            backend = table_backend()
+        return self.cache_io(name, func, backend, **kwargs)
+
     def pkl_io(self, name, func, **kwargs):
-        cd = self.cache_dir()
-        pklpath = os.path.join(cd, name + PICKLETLD)
-        if os.path.isfile(pklpath):
-            with open(pklpath, 'rb') as cachefile:
-                data = pickle.load(cachefile)
-        else:
-            ensure_dir(cd)
-            data = func(**kwargs)
-            with open(pklpath, 'wb') as cachefile:
-                pickle.dump(data, cachefile, pickle.HIGHEST_PROTOCOL)
-        return data
+        return self.cache_io(name, func, PickleBackend(), **kwargs)
+
+    def cache_entries(self):
+        """Return cache entry files in the cache directory of any version."""
+        entries = []
+        for ext in BACKENDS:
+            entries.extend(glob(os.path.join(self.cache_dir(), '*.v*' + ext)))
+        return entries
 
     def clear_cache(self, extra_files=None):
         """Remove cache files used by the Cacher object."""
@@ -106,7 +722,11 @@ class Cacher:
             filelist.extend(extra_files)
         for f in filelist:
             os.remove(f)
+        self._store_memo = {}
 
     def fingerprint(self):
         """state-aware object identifier, immutable between sessions"""
-        pass
\ No newline at end of file
+        pass
+
+if __name__ == '__main__':
+    sys.exit(main())
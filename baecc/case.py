@@ -15,6 +15,9 @@ from pytmatrix import tmatrix_aux as tm_aux
 from j24 import daterange2str, limitslist
 
 RHO_W = 1000
+# PSD moment orders calculated together by Case.moments
+MOMENT_ORDERS = (0, 1, 2, 3, 4, 6)
+MOM_ORDERS = (3, 6)
 
 
 def scatterplot(x, y, c=None, kind='scatter', **kwargs):
@@ -174,23 +177,26 @@ class Case(instruments.PrecipMeasurer, caching.Cacher):
     @classmethod
     def from_hdf(cls, dt_start, dt_end, filenames=[baecc.H5_PATH], radar=False,
                  pluvio_name='pluvio200', **kwargs):
-        """Create Case object from a hdf file."""
-        for dt in [dt_start, dt_end]:
-            dt = pd.to_datetime(dt)
-        pluvio = instruments.pluvio.Pluvio(filenames, hdf_table=pluvio_name)
-        dsd = instruments.pip_psd.PipPSD(filenames, hdf_table='pip_dsd')
-        pipv = instruments.pip_v.PipV(filenames, hdf_table='pip_vel')
+        """Create Case object from a hdf file or a partitioned archive."""
+        span = {'dt_start': pd.to_datetime(dt_start),
+                'dt_end': pd.to_datetime(dt_end)}
+        pluvio = instruments.pluvio.Pluvio(filenames, hdf_table=pluvio_name,
+                                           **span)
+        dsd = instruments.pip_psd.PipPSD(filenames, hdf_table='pip_dsd',
+                                         **span)
+        pipv = instruments.pip_v.PipV(filenames, hdf_table='pip_vel', **span)
         if radar:
-            xsacr = instruments.radar.Radar(filenames, hdf_table='XSACR')
-            kasacr = instruments.radar.Radar(filenames, hdf_table='KASACR')
-            kazr = instruments.radar.Radar(filenames, hdf_table='KAZR')
-            mwacr = instruments.radar.Radar(filenames, hdf_table='MWACR')
+            xsacr = instruments.radar.Radar(filenames, hdf_table='XSACR',
+                                            **span)
+            kasacr = instruments.radar.Radar(filenames, hdf_table='KASACR',
+                                             **span)
+            kazr = instruments.radar.Radar(filenames, hdf_table='KAZR', **span)
+            mwacr = instruments.radar.Radar(filenames, hdf_table='MWACR',
+                                            **span)
             instr_lst = [dsd, pipv, pluvio, xsacr, kasacr, kazr,
                          mwacr]
         else:
             instr_lst = [dsd, pipv, pluvio]
-        for instr in instr_lst:
-            instr.set_span(dt_start, dt_end)
         return cls(*instr_lst, **kwargs)
 
     def casetype(self):
@@ -204,7 +210,8 @@ class Case(instruments.PrecipMeasurer, caching.Cacher):
         return self.rule
 
     def fingerprint(self):
-        idstr = str(self.dt_start_end()) + self.casetype() + self.intervalstr()
+        """identifier from instrument fingerprints, which cover the time span"""
+        idstr = self.casetype() + self.intervalstr()
         for key, instr in sorted(self.instr.items()):
             idstr += instr.fingerprint()
         return caching.fingerprint(idstr)
@@ -267,12 +274,15 @@ class Case(instruments.PrecipMeasurer, caching.Cacher):
         return i*(delta/timedelta(hours=1))
 
     def sum_over_d(self, func, **kwargs):
-        """numerical integration over particle diameter"""
-        dD = self.instr['dsd'].bin_width()
-        result = self.series_zeros()
-        for d in self.instr['dsd'].bin_cen():
-            result = result.add(func(d, **kwargs)*dD[d], fill_value=0)
-        return result
+        """numerical integration over particle diameter
+
+        The integrand func is evaluated once for the array of all bin centers
+        and should return a DataFrame with a column for each bin, as e.g.
+        r_ab, r_rho and w_slice do when given an array of diameters."""
+        dsd = self.instr['dsd']
+        integrand = func(dsd.bin_cen(), **kwargs)
+        result = integrand.mul(dsd.bin_width(), axis=1).sum(axis=1)
+        return self.series_zeros().add(result, fill_value=0)
 
     def r_ab(self, d, alpha, beta):
         """(mm/h)/(m/s)*kg/mg / kg/m**3 * mg/mm**beta * mm**beta * m/s * 1/(mm*m**3)
@@ -295,7 +305,7 @@ class Case(instruments.PrecipMeasurer, caching.Cacher):
 
     def w_slice(self, d, **kwargs):
         rho = self.density(**kwargs)
-        return 1e-6*np.pi/6*rho*d**3*self.n(d)
+        return (1e-6*np.pi/6*d**3*self.n(d)).mul(rho, axis=0)
 
     def w(self, method='gamma', **kwargs):
         """water content in g/m**3"""
@@ -312,49 +322,45 @@ class Case(instruments.PrecipMeasurer, caching.Cacher):
                     rule=self.rule, **kwargs)
 
     def v(self, d):
-        """velocity wrapper, m/s"""
+        """velocity wrapper, m/s
+
+        Given an array of diameters, return the v(t, D) matrix."""
         return self.intervalled(self.instr['pipv'].v, d)
 
     def n(self, d):
-        """N wrapper"""
+        """N wrapper
+
+        Given an array of diameters, return the N(t, D) matrix."""
         return self.intervalled(self.instr['dsd'].n, d)
 
     def f_mu(self):
         mu = self.mu()
         return 6/(3.67)**4*(3.67+mu)**(mu+4)/(gamma(mu+4))
 
-    def n_t(self):
+    def n_t(self, moments=None):
         """total concentration"""
-        name = 'N_t'
-        def func():
-            nt = self.sum_over_d(self.n)
-            nt.name = name
-            return nt
-        return self.msger(name, func)
+        return self.n_moment(0, moments=moments).rename('N_t')
 
-    def d_m(self):
+    def d_m(self, moments=None):
         """mass weighted mean diameter, mm"""
-        name = 'D_m'
-        def func():
-            dm = self.n_moment(4)/self.n_moment(3)
-            dm.name = name
-            return dm
-        return self.msger(name, func)
+        if moments is None:
+            moments = self.moments()
+        dm = self.n_moment(4, moments=moments)/self.n_moment(3, moments=moments)
+        dm.name = 'D_m'
+        return dm
 
     def d_0(self):
         """median volume diameter, mm"""
         name = 'D_0'
         def func():
-            idxd = self.instr['dsd'].good_data().columns
-            dd = pd.Series(idxd)
+            d = self.instr['dsd'].bin_cen()
             dD = self.instr['dsd'].bin_width()
-            d3n = lambda d: d**3*self.n(d)*dD[d]
+            d3n = (d**3*self.n(d)).mul(dD, axis=1)
             #d3n = lambda d: dD[d]*self.n(d)*((d+dD[d]*0.5)**4.0-(d-dD[d]*0.5)**4.0)/(dD[d]*4.0)
-            cumvol = dd.apply(d3n).cumsum().T
-            cumvol.columns = idxd
+            cumvol = d3n.cumsum(axis=1)
             sumvol = cumvol.iloc[:, -1]
             diff = cumvol.sub(sumvol/2, axis=0)
-            dmed = diff.abs().T.idxmin()
+            dmed = diff.abs().idxmin(axis=1)
             dmed[sumvol < 0.0001] = 0
             dmed.name = name
             return dmed
@@ -364,68 +370,86 @@ class Case(instruments.PrecipMeasurer, caching.Cacher):
         """maximum diameter from PSD tables, mm"""
         name = 'D_max'
         def func():
-            idxd = self.instr['dsd'].good_data().columns
-            dd = pd.Series(idxd)
-            nd = dd.apply(self.n).T
-            nd.columns = idxd
-            dmax = nd[nd > 0.0001].T.apply(pd.Series.last_valid_index).fillna(0)
+            nd = self.n(self.instr['dsd'].bin_cen())
+            dmax = nd[nd > 0.0001].apply(pd.Series.last_valid_index,
+                                         axis=1).fillna(0)
             dmax.name = name
             return dmax
         return self.msger(name, func)
 
-    def n_moment(self, n):
-        name = 'M' + str(n)
+    def moments(self, orders=MOMENT_ORDERS, mom_orders=MOM_ORDERS):
+        """PSD moments of requested orders calculated in a single pass.
+
+        Columns M<n> are the n_moment and mom<n> the mom_n products."""
+        params_id = str(tuple(orders)) + str(tuple(mom_orders))
+        name = 'moments' + caching.fingerprint(params_id)
         def func():
-            moment = lambda d: d**n*self.n(d)
-            nth_mo = self.sum_over_d(moment)
-            nth_mo.name = name
-            return nth_mo
+            dsd = self.instr['dsd']
+            d = dsd.bin_cen()
+            dD = dsd.bin_width().values
+            d_high = d+dD*0.5
+            d_low = d-dD*0.5
+            weights = pd.DataFrame(index=d)
+            for n in orders:
+                weights['M' + str(n)] = d**n*dD
+            for n in mom_orders:
+                weights['mom' + str(n)] = (d_high**(n+1)-d_low**(n+1))/(n+1)
+            moments = self.n(d).fillna(0).dot(weights)
+            index = moments.index.union(self.series_zeros().index)
+            return moments.reindex(index).fillna(0)
         return self.msger(name, func)
-    
+
+    def n_moment(self, n, moments=None):
+        """nth moment of the PSD"""
+        if moments is None:
+            if n in MOMENT_ORDERS:
+                moments = self.moments()
+            else:
+                moments = self.moments(orders=(n,), mom_orders=())
+        return moments['M' + str(n)]
+
     #TODO: What is the difference between this and n_moment?
-    def mom_n(self, n):
-        name = 'mom' + str(n)
-        def func():
-            dD = self.instr['dsd'].bin_width()
-            d_high = lambda d: d+dD[d]*0.5
-            d_low =  lambda d: d-dD[d]*0.5
-            moment = lambda d: self.n(d)*(d_high(d)**(n+1)-d_low(d)**(n+1))/(dD[d]*(n+1))
-            nth_mo = self.sum_over_d(moment)
-            nth_mo.name = name
-            return nth_mo
-        return self.msger(name, func)
+    def mom_n(self, n, moments=None):
+        """nth moment of the PSD integrated over bin edges"""
+        if moments is None:
+            if n in MOM_ORDERS:
+                moments = self.moments()
+            else:
+                moments = self.moments(orders=(), mom_orders=(n,))
+        return moments['mom' + str(n)]
+
+    def gamma_params(self, moments=None):
+        """gamma PSD parameters eta, mu, lambda, N_0 and D_0_gamma"""
+        if moments is None:
+            moments = self.moments()
+        m2 = self.n_moment(2, moments=moments)
+        m4 = self.n_moment(4, moments=moments)
+        m6 = self.n_moment(6, moments=moments)
+        eta = m4**2/(m6*m2)
+        mu = ((7-11*eta)-np.sqrt(eta**2+14*eta+1))/(2*(eta-1))
+        lam = np.sqrt(m2*gamma(mu+5)/(m4*gamma(mu+3)))
+        n0 = m2*lam**(mu+3)/gamma(mu+3)
+        d0 = (3.67+mu)/lam
+        params = pd.concat([eta, mu, lam, n0, d0], axis=1)
+        params.columns = ['eta', 'mu', 'lambda', 'N_0', 'D_0_gamma']
+        return params
 
     def eta(self):
-        eta = self.n_moment(4)**2/(self.n_moment(6)*self.n_moment(2))
-        eta.name = 'eta'
-        return eta
+        return self.gamma_params()['eta']
 
     def mu(self):
-        eta = self.eta()
-        mu = ((7-11*eta)-np.sqrt(eta**2+14*eta+1))/(2*(eta-1))
-        mu.name = 'mu'
-        return mu
+        return self.gamma_params()['mu']
 
     def lam(self):
-        mu = self.mu()
-        lam = np.sqrt(self.n_moment(2)*gamma(mu+5)/(self.n_moment(4)*gamma(mu+3)))
-        lam.name = 'lambda'
-        return lam
+        return self.gamma_params()['lambda']
 
     def n_0(self):
-        mu = self.mu()
-        n0 = self.n_moment(2)*self.lam()**(mu+3)/gamma(mu+3)
-        n0.name = 'N_0'
-        return n0
+        return self.gamma_params()['N_0']
 
-    def n_w(self):
-        name = 'N_w'
-        def func():
-            integrand = lambda d: d**3*self.n(d)
-            nw = 3.67**4/(6*self.d_0()**4)*self.sum_over_d(integrand)
-            nw.name = name
-            return nw
-        return self.msger(name, func)
+    def n_w(self, moments=None):
+        nw = 3.67**4/(6*self.d_0()**4)*self.n_moment(3, moments=moments)
+        nw.name = 'N_w'
+        return nw
 
     def n_w_mu(self, **kwargs):
         mu = self.mu()
@@ -433,12 +457,7 @@ class Case(instruments.PrecipMeasurer, caching.Cacher):
         return self.n_0()/self.f_mu()*self.d_0()**mu
 
     def d_0_gamma(self):
-        name = 'D_0_gamma'
-        def func():
-            d0 = (3.67+self.mu())/self.lam()
-            d0.name = name
-            return d0
-        return self.msger(name, func)
+        return self.gamma_params()['D_0_gamma']
 
     def partcount(self):
         """particle count"""
@@ -549,10 +568,7 @@ class Case(instruments.PrecipMeasurer, caching.Cacher):
         if data is None:
             data = pipv.good_data()
         data_in_range = self.data_in_density_range(data, rhomin, rhomax)
-        fit = pipv.find_fit(data=data_in_range, **fitargs)[0]
-        fit.x_unfiltered = data_in_range[pipv.d_col].values
-        fit.y_unfiltered = data_in_range.vel_v.values
-        return fit
+        return pipv.find_fit(data=data_in_range, **fitargs)[0]
 
     def vfits_density_range(self, limslist, **fitargs):
         params_id = str(limslist) + caching.hash_dict(fitargs)
@@ -761,13 +777,13 @@ class Case(instruments.PrecipMeasurer, caching.Cacher):
     def plot_velfitcoefs(self, fig=None, ax=None, rhomin=None, rhomax=None,
                          countmin=1, **kwargs):
         rho = self.density()
-        params = self.instr['pipv'].fits.polfit.apply(lambda fit: fit.params)
+        params = self.instr['pipv'].fit_params(baecc.fit.PolFit.name)
         selection = pd.DataFrame([rho.notnull(),
                                   self.partcount() > countmin]).all()
         rho = rho[selection]
         params = params[selection]
-        a = params.apply(lambda p: p[0]).values
-        b = params.apply(lambda p: p[1]).values
+        a = params.a.values
+        b = params.b.values
         if fig is None:
             fig = plt.figure(dpi=120)
         if ax is None:
@@ -782,15 +798,14 @@ class Case(instruments.PrecipMeasurer, caching.Cacher):
     def plot_d0_bv(self, rhomin=None, rhomax=None, countmin=1,
                    count_as_size=True, countscale=4, **kwargs):
         rho = self.density()
-        params = self.instr['pipv'].fits.polfit.apply(lambda fit: fit.params)
+        params = self.instr['pipv'].fit_params(baecc.fit.PolFit.name)
         selection = pd.DataFrame([rho.notnull(),
                                   self.partcount() > countmin]).all()
         count = self.partcount()[selection]
         rho = rho[selection]
         params = params[selection]
         d0 = self.d_0_gamma()[selection]
-        b = params.apply(lambda p: p[1])
-        b.name = 'b'
+        b = params.b
         if count_as_size:
             kwargs['s'] = 0.01*countscale*count
         if rhomin is None:
@@ -807,30 +822,27 @@ class Case(instruments.PrecipMeasurer, caching.Cacher):
         casename.name = 'case'
         pluvio = self.instr['pluvio']
         pipv = self.instr['pipv']
+        moments = self.moments()
+        gamma_params = self.gamma_params(moments=moments)
         params = [self.partcount(),
                   self.density(),
                   self.d_0(),
-                  self.n_t(),
+                  self.n_t(moments=moments),
                   casename,
                   pipv.fit_params(),
                   #self.d(),
-                  self.d_m(),
+                  self.d_m(moments=moments),
                   self.d_max(),
-                  self.d_0_gamma(),
+                  gamma_params['D_0_gamma'],
                   #self.amount(params=[100], simple=True), # What is this?
                   pluvio.amount(),
                   pluvio.intensity(),
                   pluvio.start_time(),
                   pluvio.half_time(),
                   pluvio.tdelta(),
-                  self.eta(),
-                  self.mu(),
-                  self.lam(),
-                  self.n_0(),
-                  self.n_w(),
-                  self.n_moment(0),
-                  self.n_moment(1),
-                  self.n_moment(2)]
+                  gamma_params[['eta', 'mu', 'lambda', 'N_0']],
+                  self.n_w(moments=moments),
+                  moments[['M0', 'M1', 'M2']]]
         if radar:
             params.extend([self.Z_rayleigh_Xband(), self.tmatrix(tm_aux.wl_X)])
         if include_vfits:
@@ -868,7 +880,7 @@ class Case(instruments.PrecipMeasurer, caching.Cacher):
         return periods
 
     def clear_cache(self):
-        xtra = glob(path.join(self.cache_dir(), '*' + caching.MSGTLD))
+        xtra = self.cache_entries()
         xtra.extend(glob(path.join(self.cache_dir(), '*.h5')))
         super().clear_cache(extra_files=xtra)
         self.reset()
@@ -79,16 +79,23 @@ class EventsCollection(caching.Cacher):
 
     def autoimport_data(self, datafile=baecc.H5_PATH, autoshift=False,
                         autobias=False, radar=False, **casekwargs):
-        """Import data from a hdf file."""
+        """Import data from a hdf file or a partitioned archive.
+
+        Data is read separately for each event."""
         timemargin = timedelta(hours=3)
-        dt_start = self.events.iloc[0].start - timemargin
-        dt_end = self.events.iloc[-1].end + timemargin
         for pluvio_name in ('pluvio200', 'pluvio400'):
-            data = case.Case.from_hdf(dt_start, dt_end, autoshift=False,
-                                 filenames=[datafile], radar=radar,
-                                 pluvio_name=pluvio_name, **casekwargs)
-            if data is not None:
-                self.add_data(data, autoshift=autoshift, autobias=autobias)
+            cases = []
+            for i, e in self.events.iterrows():
+                data = case.Case.from_hdf(e.start-timemargin, e.end+timemargin,
+                                          autoshift=False, filenames=[datafile],
+                                          radar=radar, pluvio_name=pluvio_name,
+                                          **casekwargs)
+                if data is not None:
+                    cases.append(data.between_datetime(e.start, e.end,
+                                                       autoshift=autoshift,
+                                                       autobias=autobias))
+            if len(cases) == len(self.events.index):
+                self.events[pluvio_name] = cases
 
     def summary(self, col=None, dtformat='{year}{month}{day}',concatkws={},
                 day_fmt='%d', month_fmt='%m', year_fmt='%y', **kwargs):
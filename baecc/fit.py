@@ -64,6 +64,12 @@ class ClassProperty(property):
         return self.fget.__get__(None, owner)()
 
 
+# attributes that determine which points pass the filter
+MASK_ATTRS = frozenset(('x_unfiltered', 'y_unfiltered', 'fltr_upper_x',
+                        'fltr_upper_y', 'fltr_lower_x', 'fltr_lower_y',
+                        'prefilter', 'flipped'))
+
+
 class Fit:
     """parent for different fit types"""
     def __init__(self, x=None, y=None, x_unfiltered=None, y_unfiltered=None,
@@ -71,8 +77,8 @@ class Fit:
                  flipped=False, disp_scale=[], use_latex_fmt=False):
         self.params = params
         self._name = name
-        self.x = x
-        self.y = y
+        self._x = x
+        self._y = y
         if x_unfiltered is None:
             self.x_unfiltered = x
             self.y_unfiltered = y
@@ -83,13 +89,98 @@ class Fit:
         self.fltr_upper_y = None
         self.fltr_lower_x = None
         self.fltr_lower_y = None
+        self.prefilter = None # Fit whose filter is applied first
+        self.n_points = None # point counts of released data
+        # whether fitted points follow from unfiltered data and filter bounds
+        self.bounds_derived = True
         self.sigma = sigma
+        self.cov = None
         self.xname = xname
         self.flipped = flipped
         self.str_fmt = ''
         self.disp_scale = np.array(disp_scale)
         self.use_latex_fmt = use_latex_fmt
 
+    def __setstate__(self, state):
+        # fits pickled before x and y were derived from unfiltered data
+        for key in ('x', 'y'):
+            if key in state:
+                state['_' + key] = state.pop(key)
+        state.setdefault('cov', None)
+        state.setdefault('prefilter', None)
+        state.setdefault('n_points', None)
+        state.setdefault('bounds_derived', True)
+        state['_mask'] = None
+        self.__dict__.update(state)
+
+    def __setattr__(self, name, value):
+        if name in MASK_ATTRS:
+            self.__dict__['_mask'] = None
+        object.__setattr__(self, name, value)
+
+    def filtered_mask(self):
+        """fltr_mask of the unfiltered data, memoized until data or bounds
+        are replaced"""
+        if self.__dict__.get('_mask') is None:
+            self._mask = self.fltr_mask()
+        return self._mask
+
+    @property
+    def x(self):
+        """fitted x data, by default unfiltered x within filter bounds"""
+        if self._x is None and self.x_unfiltered is not None:
+            return self.x_unfiltered[self.filtered_mask()]
+        return self._x
+
+    @x.setter
+    def x(self, x):
+        self._x = x
+
+    @property
+    def y(self):
+        """fitted y data, by default unfiltered y within filter bounds"""
+        if self._y is None and self.y_unfiltered is not None:
+            return self.y_unfiltered[self.filtered_mask()]
+        return self._y
+
+    @y.setter
+    def y(self, y):
+        self._y = y
+
+    def materialize(self):
+        """Store fitted and unfiltered data as independent arrays."""
+        x, y = self.x, self.y
+        if x is not None:
+            self.x, self.y = np.array(x), np.array(y)
+        if self.x_unfiltered is not None:
+            self.x_unfiltered = np.array(self.x_unfiltered)
+            self.y_unfiltered = np.array(self.y_unfiltered)
+        return self
+
+    def release_data(self, keep_fitted=False):
+        """Drop data arrays, keeping only the numbers of points.
+
+        With keep_fitted, independent copies of the fitted points are kept."""
+        self.n_points = (self.point_count(filtered=False),
+                         self.point_count(filtered=True))
+        x, y = None, None
+        if keep_fitted and self.x is not None:
+            x, y = np.array(self.x), np.array(self.y)
+        self.x_unfiltered = None
+        self.y_unfiltered = None
+        self._x = x
+        self._y = y
+        return self
+
+    def point_count(self, filtered=True):
+        """number of fitted or unfiltered data points"""
+        data = self.x if filtered else self.x_unfiltered
+        if data is None:
+            if self.n_points is not None:
+                return self.n_points[int(filtered)]
+            return 0
+        return np.size(data)
+
     def __repr__(self):
         if self.params is None:
             paramstr = 'abcdefghijklmnopqrstuvwxyz'[:self.str_fmt.count('%')]
@@ -113,6 +204,15 @@ class Fit:
             return self.func(x, *self.params)
         pass
 
+    def func_stack(self, x, params):
+        """Evaluate fit function for a stack of coefficient sets at once.
+
+        params has a row of coefficients for each set. Return an array of
+        shape (len(params), len(x))."""
+        x = np.asarray(x, dtype=float)[np.newaxis, :]
+        params = np.atleast_2d(np.asarray(params, dtype=float))
+        return self.func(x, *params.T[:, :, np.newaxis])
+
     def penalty(self, params):
         """penalty function used by the cost function"""
         return 0
@@ -181,6 +281,8 @@ class Fit:
         else:
             x = self.x
             y = self.y
+        x = np.asarray(x, dtype=float)
+        y = np.asarray(y, dtype=float)
         params, cov = optimize.curve_fit(self.func, x, y, **kwargs)
         if self.flipped:
             params = self.flip_params(params)
@@ -199,6 +301,45 @@ class Fit:
             cov = self.cov
         return np.sqrt(np.diag(cov))
 
+    def filter_bounds(self):
+        """Return a Fit holding only the filter bounds of this fit."""
+        bounds = type(self)(flipped=self.flipped)
+        for attr in ('fltr_upper_x', 'fltr_upper_y', 'fltr_lower_x',
+                     'fltr_lower_y', 'prefilter'):
+            setattr(bounds, attr, getattr(self, attr))
+        return bounds
+
+    def fltr_mask(self, x=None, y=None):
+        """Boolean mask of data points inside the filter bounds.
+
+        Points must also pass the prefilter if one is set."""
+        if x is None:
+            x, y = self.x_unfiltered, self.y_unfiltered
+        x = np.asarray(x, dtype=float)
+        y = np.asarray(y, dtype=float)
+        if self.prefilter is not None:
+            premask = self.prefilter.fltr_mask(x, y)
+        else:
+            premask = np.ones(x.size, dtype=bool)
+        if self.fltr_upper_x is None:
+            return premask
+        if self.flipped:
+            edges, lower, upper = (self.fltr_lower_y, self.fltr_lower_x,
+                                   self.fltr_upper_x)
+            binned, bounded = y, x
+        else:
+            edges, lower, upper = (self.fltr_lower_x, self.fltr_lower_y,
+                                   self.fltr_upper_y)
+            binned, bounded = x, y
+        edges = np.asarray(edges, dtype=float)
+        lower = np.array(lower, dtype=float) # None for rejected bins
+        upper = np.array(upper, dtype=float)
+        i = np.searchsorted(edges, binned, side='right')-1
+        i = i.clip(0, edges.size-2)
+        with np.errstate(invalid='ignore'):
+            return (premask & (binned > edges[i]) & (binned < edges[i+1]) &
+                    (bounded > lower[i]) & (bounded < upper[i]))
+
     def xy(self, filtered=True):
         if filtered:
             return self.x, self.y
@@ -245,8 +386,8 @@ class LinFit(Fit):
     def find_fit(self, store_params=True, **kwargs):
         if self.x is None or self.y is None:
             return
-        x = self.x
-        y = self.y
+        x = np.asarray(self.x, dtype=float)
+        y = np.asarray(self.y, dtype=float)
         a, b, self.rvalue, self.pvalue, self.stderr = linregress(x, y)
         if store_params:
             self.params = (a, b)
@@ -358,8 +499,8 @@ class PolFit(Fit):
         return params, cov
 
     def find_fit_loglog(self):
-        logx = np.log10(self.x)
-        logy = np.log10(self.y)
+        logx = np.log10(np.asarray(self.x, dtype=float))
+        logy = np.log10(np.asarray(self.y, dtype=float))
         fitfunc = lambda p, x: p[0]+p[1]*x
         errfunc = lambda p, x, y: fitfunc(p, x)-y
         out = optimize.leastsq(errfunc, self.quess, args=(logx, logy),
@@ -371,5 +512,99 @@ class PolFit(Fit):
         return (a, b), cov
 
 
+def fit_loglog_batch(x, y, groups, n_groups=None):
+    """Fit power laws a*x**b to several groups of data at once.
+
+    Straight lines are fitted in log10 space to each group given by integer
+    group codes. Return parameter array with rows (a, b) and covariance array
+    of log10(a) and b with the same scaling as in PolFit.find_fit_loglog.
+    Groups with less than two distinct x values get nan parameters."""
+    logx = np.log10(np.asarray(x, dtype=float))
+    logy = np.log10(np.asarray(y, dtype=float))
+    groups = np.asarray(groups, dtype=int)
+    if n_groups is None:
+        n_groups = groups.max()+1 if groups.size else 0
+    n = np.bincount(groups, minlength=n_groups).astype(float)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mean_x = np.bincount(groups, weights=logx, minlength=n_groups)/n
+        mean_y = np.bincount(groups, weights=logy, minlength=n_groups)/n
+        dx = logx-mean_x[groups]
+        dy = logy-mean_y[groups]
+        sxx = np.bincount(groups, weights=dx*dx, minlength=n_groups)
+        sxy = np.bincount(groups, weights=dx*dy, minlength=n_groups)
+        sxx[~(sxx > 0)] = np.nan
+        b = sxy/sxx
+        loga = mean_y-b*mean_x
+        cov = np.empty((n_groups, 2, 2))
+        cov[:, 0, 0] = 1/n+mean_x**2/sxx
+        cov[:, 0, 1] = -mean_x/sxx
+        cov[:, 1, 0] = cov[:, 0, 1]
+        cov[:, 1, 1] = 1/sxx
+    params = np.column_stack((10**loga, b))
+    return params, cov
+
+
+# fit types that can be evaluated from stacked coefficient arrays
+STACKABLE_FITS = (LinFit, ExpFit, PolFit)
+FIT_CLASSES = {fitclass.name: fitclass for fitclass in (LinFit, ExpFit, LogFit,
+                                                         ExponentialFit,
+                                                         PolFit)}
+
+
+def stack_params(fits):
+    """Stack fit coefficients to an array with a row for each fit.
+
+    Rows of fits with no coefficients are filled with nans."""
+    n_params = max([len(vfit.params) for vfit in fits
+                    if vfit.params is not None] + [0])
+    params = np.full((len(fits), n_params), np.nan)
+    for i, vfit in enumerate(fits):
+        if vfit.params is not None:
+            params[i] = vfit.params
+    return params
+
+
+def stacked_func(fitclass, x, params, flipped=None):
+    """Evaluate fitclass function at x for each row of coefficients.
+
+    Return an array of shape (len(params), len(x))."""
+    x = np.asarray(x, dtype=float)
+    params = np.atleast_2d(np.asarray(params, dtype=float))
+    if flipped is None:
+        flipped = np.zeros(len(params), dtype=bool)
+    flipped = np.asarray(flipped, dtype=bool)
+    y = np.full((len(params), x.size), np.nan)
+    if params.shape[1] == 0: # none of the fits have coefficients
+        return y
+    for flip in (False, True):
+        selection = flipped == flip
+        if selection.any():
+            vfit = fitclass(flipped=flip)
+            y[selection] = vfit.func_stack(x, params[selection])
+    return y
+
+
+def evaluate_fits(fits, x):
+    """Evaluate a sequence of fits at x.
+
+    Return an array of shape (len(fits), len(x)) with nans for fits with no
+    coefficients. Fits of a single stackable type are evaluated without
+    looping over the fit objects."""
+    fits = list(fits)
+    x = np.asarray(x, dtype=float)
+    fitclasses = set(type(vfit) for vfit in fits)
+    if len(fitclasses) == 1:
+        fitclass = fitclasses.pop()
+        if fitclass in STACKABLE_FITS:
+            flipped = [vfit.flipped for vfit in fits]
+            return stacked_func(fitclass, x, stack_params(fits),
+                                flipped=flipped)
+    y = np.full((len(fits), x.size), np.nan)
+    for i, vfit in enumerate(fits):
+        if vfit.params is not None:
+            y[i] = vfit.func(x)
+    return y
+
+
 gunn_kinzer = ExpFit(params=GUNN_KINZER)
 set_plot_style()
@@ -1,8 +1,14 @@
 # coding: utf-8
 from __future__ import absolute_import, division, print_function
 import gc
+import os
+from os import path
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import pandas as pd
 import baecc
-from baecc.instruments.base import InstrumentData, PrecipMeasurer, datafilelistloop
+from baecc import storage
+from baecc.instruments.base import InstrumentData, PrecipMeasurer, datafilelistloop, read_files
 from baecc.instruments import pluvio
 from baecc.instruments import pip_psd
 from baecc.instruments import pip_v
@@ -11,48 +17,185 @@ from baecc.instruments import radar
 # PIP-observed particle size to the volume equivalent diameter
 PHI = 0.92
 
+# columns of the manifest of raw data files stored in hdf
+MANIFEST_COLS = ['path', 'size', 'mtime_ns', 'rows', 'table', 't_start',
+                 't_end']
+# modification times closer than this are considered equal, to also match
+# manifests with mtime stored as float seconds
+MTIME_TOLERANCE_NS = 1000
 
-def batch_import(dtstrlist, datadir=baecc.DATA_DIR, use_radar=False):
-    """Read ASCII data according to a datestring pattern."""
-    pipv_files = datafilelistloop(pip_v.SUBPATH, dtstrlist, datadir=datadir)
-    dsd_files = datafilelistloop(pip_psd.SUBPATH, dtstrlist, datadir=datadir)
-    pluvio200_files = datafilelistloop(pluvio.P200_SUBPATH, dtstrlist, datadir=datadir)
-    pluvio400_files = datafilelistloop(pluvio.P400_SUBPATH, dtstrlist, datadir=datadir)
-    if use_radar:
-        xsacr_files = datafilelistloop(radar.SUBPATH, [('XSACR', 'xsacr', dtstr) for dtstr in dtstrlist],
-                                   datadir=datadir)
-        kasacr_files = datafilelistloop(radar.SUBPATH, [('KASACR', 'kasacr', dtstr) for dtstr in dtstrlist],
-                                    datadir=datadir)
-        kazr_files = datafilelistloop(radar.SUBPATH, [('KAZR', 'kazrge', dtstr) for dtstr in dtstrlist],
-                                  datadir=datadir)
-        mwacr_files = datafilelistloop(radar.SUBPATH, [('MWACR', 'mwacr', dtstr) for dtstr in dtstrlist],
-                                   datadir=datadir)
-    pluvio200 = pluvio.Pluvio(pluvio200_files)
-    pluvio400 = pluvio.Pluvio(pluvio400_files)
-    pipv = pip_v.PipV(pipv_files)
-    dsd = pip_psd.PipPSD(dsd_files)
+
+def batch_import(dtstrlist, datadir=baecc.DATA_DIR, use_radar=False,
+                 processes=1, concurrent=False):
+    """Read ASCII data according to a datestring pattern.
+
+    Files of each instrument are parsed using the given number of worker
+    processes. With concurrent, the instruments are read simultaneously in
+    threads, which cannot be combined with worker processes."""
+    if concurrent and processes > 1:
+        raise ValueError('concurrent reading cannot be combined with '
+                         'processes > 1')
+    files = {'vel': datafilelistloop(pip_v.SUBPATH, dtstrlist,
+                                     datadir=datadir),
+             'dsd': datafilelistloop(pip_psd.SUBPATH, dtstrlist,
+                                     datadir=datadir),
+             'pluvio200': datafilelistloop(pluvio.P200_SUBPATH, dtstrlist,
+                                           datadir=datadir),
+             'pluvio400': datafilelistloop(pluvio.P400_SUBPATH, dtstrlist,
+                                           datadir=datadir)}
+    classes = {'vel': pip_v.PipV,
+               'dsd': pip_psd.PipPSD,
+               'pluvio200': pluvio.Pluvio,
+               'pluvio400': pluvio.Pluvio}
     if use_radar:
-        xsacr = radar.Radar(xsacr_files)
-        kasacr = radar.Radar(kasacr_files)
-        kazr = radar.Radar(kazr_files)
-        mwacr = radar.Radar(mwacr_files)
-        return {'vel': pipv, 'dsd': dsd, 'pluvio200': pluvio200,
-                'pluvio400': pluvio400, 'xsacr': xsacr, 'kasacr': kasacr,
-                'kazr': kazr, 'mwacr': mwacr}
-    return {'vel': pipv, 'dsd': dsd, 'pluvio200': pluvio200,
-            'pluvio400': pluvio400}
+        for key, mode, prefix in (('xsacr', 'XSACR', 'xsacr'),
+                                  ('kasacr', 'KASACR', 'kasacr'),
+                                  ('kazr', 'KAZR', 'kazrge'),
+                                  ('mwacr', 'MWACR', 'mwacr')):
+            files[key] = datafilelistloop(radar.SUBPATH,
+                                          [(mode, prefix, dtstr) for dtstr in dtstrlist],
+                                          datadir=datadir)
+            classes[key] = radar.Radar
+    def read(key):
+        return classes[key](files[key], processes=processes)
+    if concurrent:
+        with ThreadPoolExecutor(max_workers=len(files)) as executor:
+            futures = {key: executor.submit(read, key) for key in files}
+            return {key: futures[key].result() for key in futures}
+    return {key: read(key) for key in files}
+
+
+def default_instrdict():
+    """raw data subpaths and corresponding instrument classes"""
+    return {pip_v.SUBPATH: pip_v.PipV,
+            pip_psd.SUBPATH: pip_psd.PipPSD,
+            pluvio.P200_SUBPATH: pluvio.Pluvio,
+            pluvio.P400_SUBPATH: pluvio.Pluvio}
+
+
+def manifest_path(hdf_file):
+    """path of the raw data file manifest of an hdf archive"""
+    return path.splitext(hdf_file)[0] + '_manifest.csv'
+
+
+def read_manifest(hdf_file):
+    """Read the manifest of raw data files already stored in hdf.
+
+    Modification times are integer nanoseconds."""
+    filename = manifest_path(hdf_file)
+    if not path.isfile(filename):
+        return pd.DataFrame(columns=MANIFEST_COLS[1:],
+                            index=pd.Index([], name=MANIFEST_COLS[0]))
+    manifest = pd.read_csv(filename, index_col=MANIFEST_COLS[0],
+                           parse_dates=['t_start', 't_end'],
+                           float_precision='round_trip')
+    if 'mtime' in manifest.columns: # float seconds in older manifests
+        mtime_ns = (manifest.pop('mtime')*1e9).round().astype(np.int64)
+        manifest.insert(1, 'mtime_ns', mtime_ns)
+    return manifest
+
+
+def write_manifest(manifest, hdf_file):
+    manifest.to_csv(manifest_path(hdf_file))
+
+
+def hdf_append_files(instrclass, filelist, hdf_file, manifest, processes=1):
+    """Append data from raw data files to hdf, recording them in manifest."""
+    table = instrclass.table_name(filelist)
+    print('Converting %s data...' % table)
+    archive = storage.backend(hdf_file)
+    frames = read_files(instrclass.read_file, filelist, processes=processes)
+    for filename, data in zip(filelist, frames):
+        stat = os.stat(filename)
+        if data.empty:
+            t_start = t_end = pd.NaT
+        else:
+            archive.append(table, data)
+            t_start, t_end = data.index.min(), data.index.max()
+        manifest.loc[filename] = [stat.st_size, stat.st_mtime_ns,
+                                  len(data.index), table, t_start, t_end]
+        del(data)
+    print()
+    return manifest
 
 
 def batch_create_hdf(instrdict=None, datadir=baecc.DATA_DIR,
-                     hdf_file=baecc.H5_PATH, dtstrlist=('20140[2-3]??')):
-    """Read ASCII data and export to hdf5."""
+                     hdf_file=baecc.H5_PATH, dtstrlist=('20140[2-3]??'),
+                     processes=1):
+    """Read ASCII data and export to hdf5, Parquet or a partitioned archive.
+
+    Data is appended to the hdf tables one raw data file at a time. Files
+    already in the manifest are skipped, use update_hdf for changed files."""
+    if instrdict is None:
+        instrdict = default_instrdict()
+    manifest = read_manifest(hdf_file)
+    for key in instrdict:
+        filelist = [filename for filename in datafilelistloop(key, dtstrlist,
+                                                              datadir=datadir)
+                    if filename not in manifest.index]
+        if len(filelist) < 1:
+            continue
+        hdf_append_files(instrdict[key], filelist, hdf_file, manifest,
+                         processes=processes)
+        write_manifest(manifest, hdf_file)
+        gc.collect()
+
+
+def overlapping_files(manifest, filenames):
+    """Return filenames and the manifest files whose stored time spans
+    overlap with them, transitively."""
+    stored = manifest[manifest['rows'] > 0]
+    selected = set(filenames)
+    while True:
+        overlap = set()
+        for filename in selected & set(stored.index):
+            entry = stored.loc[filename]
+            same = stored[(stored['table'] == entry['table']) &
+                          (stored['t_start'] <= entry['t_end']) &
+                          (stored['t_end'] >= entry['t_start'])]
+            overlap.update(same.index)
+        if overlap <= selected:
+            return sorted(selected)
+        selected |= overlap
+
+
+def update_hdf(instrdict=None, datadir=baecc.DATA_DIR,
+               hdf_file=baecc.H5_PATH, dtstrlist=('20140[2-3]??'),
+               processes=1):
+    """Export only new or changed ASCII data files to hdf5.
+
+    Rows are removed by time span, so files whose time spans overlap with a
+    changed file are re-read along with it."""
     if instrdict is None:
-        instrdict = {pip_v.SUBPATH: pip_v.PipV,
-                     pip_psd.SUBPATH: pip_psd.PipPSD,
-                     pluvio.P200_SUBPATH: pluvio.Pluvio,
-                     pluvio.P400_SUBPATH: pluvio.Pluvio}
+        instrdict = default_instrdict()
+    manifest = read_manifest(hdf_file)
+    archive = storage.backend(hdf_file)
     for key in instrdict:
-        instr = instrdict[key].from_raw(dtstrlist, subpath=key, datadir=datadir)
-        instr.to_hdf(filename=hdf_file)
-        del(instr)
+        new = []
+        changed = []
+        for filename in datafilelistloop(key, dtstrlist, datadir=datadir):
+            if filename not in manifest.index:
+                new.append(filename)
+                continue
+            entry = manifest.loc[filename]
+            stat = os.stat(filename)
+            mtime_diff = abs(int(entry['mtime_ns']) - stat.st_mtime_ns)
+            if (entry['size'] != stat.st_size or
+                mtime_diff > MTIME_TOLERANCE_NS):
+                changed.append(filename)
+        replaced = overlapping_files(manifest, changed)
+        for filename in replaced:
+            entry = manifest.loc[filename]
+            if entry['rows'] > 0:
+                archive.remove(entry['table'], entry['t_start'],
+                               entry['t_end'])
+            if not path.isfile(filename):
+                manifest.drop(filename, inplace=True)
+        filelist = new + [f for f in replaced if path.isfile(f)]
+        if len(filelist) < 1:
+            write_manifest(manifest, hdf_file)
+            continue
+        hdf_append_files(instrdict[key], filelist, hdf_file, manifest,
+                         processes=processes)
+        write_manifest(manifest, hdf_file)
         gc.collect()
@@ -1,11 +1,16 @@
 # coding: utf-8
 from __future__ import absolute_import, division, print_function
 import copy
+from collections import deque
+from multiprocessing import Pool
 import numpy as np
 import pandas as pd
+from datetime import timedelta
 from os import path
 from glob import glob
-from baecc import caching, DATA_DIR
+from baecc import caching, storage, DATA_DIR
+
+READ_AHEAD = 2 # files read ahead per process in read_files
 
 
 def datafilelist(subpath, datadir=DATA_DIR):
@@ -19,6 +24,45 @@ def datafilelistloop(subpath, dtstrlist, datadir=DATA_DIR):
     return listout
 
 
+def read_files(reader, filenames, processes=1):
+    """Apply reader to each file, in a process pool if processes > 1.
+
+    Results are yielded in file order. At most READ_AHEAD files per process
+    are read ahead of the consumer, which bounds memory use."""
+    if processes > 1:
+        with Pool(processes) as pool:
+            pending = deque()
+            for filename in filenames:
+                pending.append(pool.apply_async(reader, (filename,)))
+                if len(pending) >= READ_AHEAD*processes:
+                    print('.', end='')
+                    yield pending.popleft().get()
+            while pending:
+                print('.', end='')
+                yield pending.popleft().get()
+    else:
+        for filename in filenames:
+            print('.', end='')
+            yield reader(filename)
+
+
+def apply_dtypes(data, dtypes, default=None):
+    """Cast columns of data according to a dtype schema.
+
+    Columns not in dtypes are cast to default, or left as they are if default
+    is None."""
+    if data.empty:
+        return data
+    schema = {}
+    for col in data.columns:
+        dtype = dtypes.get(col, default)
+        if dtype is not None and data[col].dtype != dtype:
+            schema[col] = dtype
+    if len(schema) == 0:
+        return data
+    return data.astype(schema)
+
+
 class PrecipMeasurer:
     """parent for classes with precipitation measurements
     Either amount or acc (or both) methods should be overridden."""
@@ -50,22 +94,63 @@ class PrecipMeasurer:
 
 class InstrumentData(caching.Cacher):
     """Parent for instrument data classes."""
+    # extra time read from hdf around the requested span
+    span_buffer = timedelta(0)
+    # dtypes of stored data columns, default_dtype for unlisted columns
+    dtypes = {}
+    default_dtype = None
 
     # TODO: Separate read_csv and __init__
-    def __init__(self, filenames=None, data=None, hdf_table=None, use_cache=True):
-        """Read from either ASCII data file or hdf5."""
+    def __init__(self, filenames=None, data=None, hdf_table=None, use_cache=True,
+                 processes=1, dt_start=None, dt_end=None, columns=None):
+        """Read from either ASCII data file or an hdf5 or Parquet archive.
+
+        Only the time span from dt_start to dt_end and the given columns are
+        read from the archive."""
         self.filenames = filenames
+        self.processes = processes # number of worker processes
         if data is None:
             self.data = pd.DataFrame()
         else:
             self.data = data
         # if filtered data needed often, keep in memory
         self.stored_good_data = None    # set to None to disable
+        self.hdf_table = hdf_table
         if hdf_table is not None:
             self.name = hdf_table
-            self.data = self.data.append(pd.read_hdf(filenames[0], hdf_table))
+            archive = storage.backend(filenames[0])
+            t_start = dt_start
+            t_end = dt_end
+            if t_start is not None:
+                t_start = pd.to_datetime(t_start)-self.span_buffer
+            if t_end is not None:
+                t_end = pd.to_datetime(t_end)+self.span_buffer
+            stored = archive.read(hdf_table, t_start, t_end, columns=columns)
+            self.data = self.data.append(self.compact(stored))
         caching.Cacher.__init__(self, use_cache=use_cache)
 
+    def __setstate__(self, state):
+        # objects pickled before data was a property
+        if 'data' in state:
+            state['_data'] = state.pop('data')
+        state.setdefault('_data_hash', None)
+        self.__dict__.update(state)
+
+    @property
+    def data(self):
+        return self._data
+
+    @data.setter
+    def data(self, data):
+        self._data = data
+        self._data_hash = None
+
+    def data_hash(self):
+        """content hash of data, memoized until data is replaced"""
+        if self._data_hash is None:
+            self._data_hash = caching.hash_frame(self._data)
+        return self._data_hash
+
     def __add__(self, other):
         combined = copy.deepcopy(self)
         combined.data = pd.concat([self.data, other.data])
@@ -73,17 +158,38 @@ class InstrumentData(caching.Cacher):
         return combined
 
     @classmethod
-    def from_raw(cls, dtstrlist, subpath='', datadir=DATA_DIR):
+    def from_raw(cls, dtstrlist, subpath='', datadir=DATA_DIR, **kwargs):
         filelist = datafilelistloop(subpath, dtstrlist, datadir=datadir)
-        return cls(filelist)
+        return cls(filelist, **kwargs)
+
+    @classmethod
+    def read_file(cls, filename):
+        """Read a raw data file to a DataFrame in the stored data format."""
+        raise NotImplementedError
+
+    @classmethod
+    def compact(cls, data):
+        """Cast data to the dtype schema of the instrument."""
+        return apply_dtypes(data, cls.dtypes, default=cls.default_dtype)
+
+    @classmethod
+    def raw_frames(cls, filenames, processes=1):
+        """Generate non-empty DataFrames of raw data files one at a time."""
+        for data in read_files(cls.read_file, filenames, processes=processes):
+            if not data.empty:
+                yield data
+
+    @classmethod
+    def table_name(cls, filenames):
+        """hdf table name for data from given raw data files"""
+        return path.basename(path.dirname(filenames[0]))
 
     def fingerprint(self):
-        return caching.fingerprint(str(self.data))
+        return caching.fingerprint(self.data_hash())
 
     def finish_init(self, dt_start, dt_end):
         """Sort and name index, cut time span."""
-        self.data.sort_index(inplace=True)
-        self.data.index.names = ['datetime']
+        self.data = self.data.sort_index().rename_axis('datetime')
         self.set_span(dt_start, dt_end)
         caching.Cacher.__init__(self, storefilename=self.name + '.h5')
 
@@ -102,8 +208,12 @@ class InstrumentData(caching.Cacher):
         return self.data
 
     def to_hdf(self, filename='../DATA/baecc.h5'):
-        """Save object in hdf5 format."""
-        self.data.to_hdf(filename, self.name, format='table', append=True)
+        """Save object in hdf5 format, or Parquet for .parquet filename.
+
+        Data is written to a table indexed by time so that time spans can be
+        selected when reading."""
+        self.data = self.data.rename_axis('datetime')
+        storage.backend(filename).append(self.name, self.data)
 
     def between_datetime(self, date_start, date_end, inplace=False):
         """Limit the time span of data."""
@@ -4,21 +4,50 @@ import matplotlib.pyplot as plt
 from matplotlib.colors import LogNorm
 import numpy as np
 import pandas as pd
-import linecache
 import datetime
 from os import path
+from io import StringIO
 import baecc
 from baecc import instruments, caching
 from pytmatrix import psd
 
 SUBPATH = 'PIP/a_DSD_Tables/004%s*.dat'
 
-def file_shorter_than(fname, limit):
-    with open(fname) as f:
-        for i, l in enumerate(f):
-            if i+2>limit:
-                return False
-    return True
+def read_psd_table(filename):
+    """Read a PIP DSD table.
+
+    The header is parsed once for the date and bin averages. Return the data
+    and the bin averages, or an empty DataFrame and None for files with no
+    data."""
+    with open(filename) as f:
+        content = f.read()
+    header = content.split('\n', 14)[:14]
+    if len(header) < 14 or header[13] == '':
+        return pd.DataFrame(), None
+    date = datetime.datetime(*[int(x) for x in header[5].split()])
+    avg = np.array(header[8].split()[5:], dtype=float)
+    csv_kws = {'skiprows': 8, 'header': 3, 'verbose': baecc.DEBUG}
+    # File format changed
+    if int(path.split(filename)[1][3:11]) > 20141124:
+        content = content.rstrip()
+        content = content[:content.rfind('\n')] # drop footer
+        data = pd.read_csv(StringIO(content), sep='\t', **csv_kws)
+    else:
+        data = pd.read_csv(StringIO(content), delim_whitespace=True,
+                           **csv_kws)
+    minutes = 60*data.pop('hr_d').values + data.pop('min_d').values
+    data.index = date + pd.to_timedelta(minutes, unit='m')
+    data.index.name = 'datetime'
+    return data, avg
+
+
+def format_psd(data):
+    """Drop extra columns of a DSD table and use bin centers as columns."""
+    #num_d = data[['Num_d']]
+    # 1st size bin is crap data, last sometimes nans
+    data = data.drop(['day_time', 'Num_d', 'Bin_cen'], axis=1)
+    data.columns = pd.Index([float(i) for i in data.columns])
+    return data.astype(float)
 
 
 def plot_psd(data, ax=None):
@@ -36,54 +65,34 @@ def plot_psd(data, ax=None):
 
 class PipPSD(instruments.InstrumentData):
     """PIP particle size distribution data handling"""
+    # concentrations are stored in single precision
+    default_dtype = np.float32
+
     def __init__(self, filenames=None, dt_start=None, dt_end=None, **kwargs):
         """Create a PipDSD object using data from a list of PIP DSD table
         files."""
-        instruments.InstrumentData.__init__(self, filenames, **kwargs)
+        instruments.InstrumentData.__init__(self, filenames,
+                                            dt_start=dt_start,
+                                            dt_end=dt_end, **kwargs)
         self.name = 'pip_dsd'
         self.use_voleq_d = True # use volume equivalent diameter
-        common_csv_kws = {'skiprows': 8,
-                          'header': 3,
-                          'parse_dates': {'datetime':['hr_d', 'min_d']},
-                          'date_parser': self.parse_datetime,
-                          'index_col': 'datetime',
-                          'verbose': baecc.DEBUG}
-        if self.data.empty:
+        if self.data.empty and self.hdf_table is None:
             print('Reading PIP PSD data...')
-            for filename in filenames:
-                if baecc.DEBUG:
-                    print(filename)
-                else:
-                    print('.', end='')
-                if file_shorter_than(filename, 14):
+            frames = []
+            avg = None
+            for newdata, newavg in instruments.read_files(read_psd_table,
+                                                          filenames,
+                                                          processes=self.processes):
+                if newavg is None:
                     # file has no data
                     continue
-                self.current_file = filename
-                # File format changed
-                if int(path.split(filename)[1][3:11]) > 20141124:
-                    self.data = self.data.append(pd.read_csv(filename,
-                                                             engine='python',
-                                                             sep='\t',
-                                                             skipfooter=1,
-                                                             **common_csv_kws))
-                else:
-                    self.data = self.data.append(pd.read_csv(filename,
-                                                             delim_whitespace=True,
-                                                             **common_csv_kws))
+                frames.append(self.compact(format_psd(newdata)))
+                avg = newavg
             print()
-            avg = pd.read_csv(self.current_file, delim_whitespace=True, skiprows=8,
-                                   nrows=1, header=None).drop([0, 1, 2, 3, 4], axis=1)
-            #self.num_d = self.data[['Num_d']]
-            # 1st size bin is crap data, last sometimes nans
-            self.data.drop(['day_time', 'Num_d', 'Bin_cen'], 1,
-                           inplace=True)
-            self.data.columns = pd.Index([float(i) for i in self.data.columns])
+            self.data = pd.concat(frames)
             self.data.sort_index(axis=1)
-            avg.columns = self.data.columns
-            self.avg = avg.T[0]
-            self.avg.name = 'dsd_avg'
-            self.data = self.data.astype(float)
-        self.data.drop_duplicates(inplace=True)
+            self.avg = pd.Series(avg, index=self.data.columns, name='dsd_avg')
+        self.data = self.data.drop_duplicates()
         # TODO: change when upgrading to pandas 0.20:
         self.data = self.data.resample('1min').asfreq().fillna(0)
         self._binned_psd = None
@@ -93,12 +102,16 @@ class PipPSD(instruments.InstrumentData):
     def from_raw(cls, *args, subpath=SUBPATH, **kwargs):
         return super().from_raw(*args, subpath=subpath, **kwargs)
 
-    def parse_datetime(self, hh, mm):
-        dateline = linecache.getline(self.current_file, 6)
-        datearr = [int(x) for x in dateline.split()]
-        d = datetime.date(*datearr)
-        t = datetime.time(int(hh), int(mm))
-        return datetime.datetime.combine(d, t)#.replace(tzinfo=datetime.timezone.utc)
+    @classmethod
+    def read_file(cls, filename):
+        data = read_psd_table(filename)[0]
+        if data.empty:
+            return data
+        return cls.compact(format_psd(data))
+
+    @classmethod
+    def table_name(cls, filenames):
+        return 'pip_dsd'
 
     def bin_cen(self):
         """Return array of bin centers as area equivalent diameter."""
@@ -122,7 +135,12 @@ class PipPSD(instruments.InstrumentData):
         return pd.Series(self.bin_cen(), index=self.bin_cen()).diff().bfill()
 
     def n(self, d, **kwargs):
-        """number concentrations for given diameter"""
+        """number concentrations for given diameter
+
+        For an array of diameters, return a DataFrame with a column of
+        concentrations for each of them."""
+        if np.ndim(d) > 0:
+            return self.psd(col=d, **kwargs)
         try:
             n = self.psd(col=d, **kwargs)
             ns = n[n.columns[0]] # convert to Series
@@ -133,7 +151,7 @@ class PipPSD(instruments.InstrumentData):
 
     def psd(self, rule='1min', varinterval=False, **kwargs):
         grp = self.grouped(rule=rule, varinterval=varinterval, **kwargs)
-        n = grp.mean()
+        n = grp.mean().astype(float) # double precision for moments
         return n
 
     def _binned_psd_at(self, t, **kws):
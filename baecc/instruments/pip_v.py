@@ -1,23 +1,126 @@
 # coding: utf-8
 from __future__ import absolute_import, division, print_function
+import copy
 import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
 import datetime
 from os import path
-from scipy import stats
+from io import StringIO
+from multiprocessing import Pool
+from scipy import stats, signal
 from scipy.optimize import fmin, minimize
 import baecc
 from baecc import fit, instruments, caching
 from j24 import ensure_dir
 
 SUBPATH = 'PIP/a_Velocity_Tables/004%s/*2.dat'
+PARAM_NAMES = 'abcdef'
+# number of deferred fits solved at once in find_fits
+DEFERRED_BATCH_SIZE = 256
 
 def kde(x, y):
-    values = np.vstack((x, y))
+    values = np.vstack((x, y)).astype(float)
     return stats.gaussian_kde(values)
 
 
+def file_datetime(filename):
+    """Return the starting hour of a velocity table from its file name."""
+    datestr = path.basename(filename).split('_')[0]
+    yr = int(datestr[3:7])
+    mo = int(datestr[7:9])
+    dd = int(datestr[9:11])
+    hh = int(datestr[11:13])
+    return datetime.datetime(yr, mo, dd, hh)
+
+
+def read_vel_table(filename):
+    """Read a PIP velocity table and average the records of each particle."""
+    if int(filename[-23:-15]) > 20141124:
+        with open(filename) as f:
+            content = f.read().rstrip()
+        content = content[:content.rfind('\n')] # drop footer
+        data = pd.read_csv(StringIO(content), sep='\t',
+                           skipinitialspace=True, skiprows=8,
+                           verbose=baecc.DEBUG)
+    else:
+        data = pd.read_csv(filename, delim_whitespace=True, skiprows=8,
+                           verbose=baecc.DEBUG)
+    data = data[data['RecNum'] > -99]
+    if data.empty:
+        return data
+    data = data.rename(columns={'vel_v_1': 'vel_v',
+                                'vel_h_1': 'vel_h',
+                                'vel_v_2': 'vel_v',
+                                'vel_h_2': 'vel_h'})
+    minutes = pd.to_timedelta(data.pop('minute_p').values, unit='m')
+    data['datetime'] = file_datetime(filename) + minutes
+    data.drop('RecNum', axis=1, inplace=True)
+    return data.groupby(['datetime', 'Part_ID']).mean()
+
+
+def _try_find_fit(pipv, name, group, **kwargs):
+    """Find fit for one interval, returning the error instead of raising."""
+    try:
+        return pipv.find_fit(data=group, name=name, try_flip=pipv.flip,
+                             **kwargs)
+    except RuntimeError as err:
+        return err
+
+
+_worker_pipv = None
+
+
+def _init_fit_worker(pipv):
+    global _worker_pipv
+    _worker_pipv = pipv
+
+
+def _fit_worker(args):
+    name, group, kwargs = args
+    return _try_find_fit(_worker_pipv, name, group, **kwargs)
+
+
+def linear_binning(x, y, xgrid, ygrid):
+    """Distribute data points to the nearest nodes of a regular grid.
+
+    Each point is split between the four surrounding grid points with
+    bilinear weights. Return weights of shape (ygrid.size, xgrid.size)."""
+    nx = xgrid.size
+    ny = ygrid.size
+    fx = np.clip((x-xgrid[0])/(xgrid[1]-xgrid[0]), 0, nx-1)
+    fy = np.clip((y-ygrid[0])/(ygrid[1]-ygrid[0]), 0, ny-1)
+    ix = np.minimum(fx.astype(int), nx-2)
+    iy = np.minimum(fy.astype(int), ny-2)
+    wx = fx-ix
+    wy = fy-iy
+    counts = np.zeros(ny*nx)
+    for jy, jx, w in ((iy, ix, (1-wy)*(1-wx)), (iy, ix+1, (1-wy)*wx),
+                      (iy+1, ix, wy*(1-wx)), (iy+1, ix+1, wy*wx)):
+        counts += np.bincount(jy*nx+jx, weights=w, minlength=ny*nx)
+    return counts.reshape(ny, nx)
+
+
+def kde_binned(x, y, xgrid, ygrid, cov):
+    """Gaussian kernel-density estimate of binned data on a regular grid.
+
+    Data are binned linearly to the grid points, and the bin weights are
+    convolved with a gaussian kernel of covariance cov using FFT."""
+    dx = xgrid[1]-xgrid[0]
+    dy = ygrid[1]-ygrid[0]
+    counts = linear_binning(x, y, xgrid, ygrid)
+    # kernel is truncated at 4 standard deviations
+    kx = int(min(np.ceil(4*np.sqrt(cov[0, 0])/dx), xgrid.size-1))
+    ky = int(min(np.ceil(4*np.sqrt(cov[1, 1])/dy), ygrid.size-1))
+    offsets = np.meshgrid(np.arange(-kx, kx+1)*dx, np.arange(-ky, ky+1)*dy)
+    points = np.vstack([offsets[0].ravel(), offsets[1].ravel()])
+    mahalanobis = np.sum(points*np.linalg.inv(cov).dot(points), axis=0)
+    norm = 2*np.pi*np.sqrt(np.linalg.det(cov))
+    kernel = np.reshape(np.exp(-0.5*mahalanobis)/norm, offsets[0].shape)
+    Z = signal.fftconvolve(counts, kernel, mode='same')/x.size
+    return Z.clip(min=0) # remove FFT rounding noise
+
+
 def bindata(xmin, xmax, data, ymin=None, ymax=None, xname='x', yname='y'):
     """Return data that falls into given x bin."""
     cond = '%s > %s and %s < %s' % (xname, xmin, xname, xmax)
@@ -28,55 +131,198 @@ def bindata(xmin, xmax, data, ymin=None, ymax=None, xname='x', yname='y'):
 
 def filter_outlier(X, Y, Z, data, xname='x', yname='y', frac=0.5,
                    bin_limit_multiplier=0.05):
-    filtered = pd.DataFrame()
-    std = []
     x = X[0, :]
     y = Y[:, 0]
     xwidth = (x[-1]-x[0])/len(x)    # TODO: check if correct
     #print('xw: %s' % xwidth)
     xlims = np.append(x-0.5*xwidth, x[-1]+0.5*xwidth)
-    xmin = xlims[:-1]
-    xmax = xlims[1:]
-    ymin = []
-    ymax = []
+    n_bins = Z.shape[1]
     data_count = data.count()[0]
-    for i in range(0, Z.shape[1]):  # loop through bins
-        z = Z[:, i]
-        z_lim = z.max()*frac
-        y_fltr = y[z > z_lim]       # FWHM when frac=0.5
-        if y_fltr.size == 0:
-            ymin.append(None)
-            ymax.append(None)
-            continue
-        ymin.append(y_fltr[0])
-        ymax.append(y_fltr[-1])
-        bin_data = bindata(xmin[i], xmax[i], data, ymin=ymin[-1], ymax=ymax[-1],
-                           xname=xname, yname=yname)
-        bin_count = bin_data.count()[0]
-        count_limit = bin_limit_multiplier*xwidth*data_count
-        if bin_count < count_limit:
-            ymin[-1] = None
-            ymax[-1] = None
-            continue
-        std.append(bin_data[yname].std())
-        filtered = filtered.append(bin_data)
+    # FWHM when frac=0.5
+    above = Z > Z.max(axis=0)*frac
+    has_peak = above.any(axis=0)
+    ymin_arr = np.where(has_peak, y[above.argmax(axis=0)], np.nan)
+    ymax_arr = np.where(has_peak, y[y.size-1-above[::-1].argmax(axis=0)],
+                        np.nan)
+    # bin index of each particle, bin limits excluded
+    xdata = data[xname].values
+    ydata = data[yname].values
+    ibin = np.searchsorted(xlims, xdata, side='right')-1
+    inbin = (ibin >= 0) & (ibin < n_bins)
+    ibin[~inbin] = 0
+    inbin &= (xdata > xlims[ibin]) & (xdata < xlims[ibin+1])
+    inbin &= (ydata > ymin_arr[ibin]) & (ydata < ymax_arr[ibin])
+    counted = inbin & data.iloc[:, 0].notnull().values
+    bin_count = np.bincount(ibin[counted], minlength=n_bins)
+    count_limit = bin_limit_multiplier*xwidth*data_count
+    accepted = has_peak & (bin_count >= count_limit)
+    ymin = [ymin_arr[i] if accepted[i] else None for i in range(n_bins)]
+    ymax = [ymax_arr[i] if accepted[i] else None for i in range(n_bins)]
+    selected = np.flatnonzero(inbin & accepted[ibin])
+    # order by bin, keeping the original order within each bin
+    selected = selected[np.argsort(ibin[selected], kind='mergesort')]
+    bin_std = data[yname].iloc[selected].groupby(ibin[selected]).std()
+    std = np.array(bin_std.reindex(np.flatnonzero(accepted)).values)
+    if selected.size == 0:
+        filtered = pd.DataFrame()
+    else:
+        filtered = data.iloc[selected]
     # return filtered data, stds and half width at frac*kde_max
-    return filtered, np.array(std), xlims, ymin, ymax
+    return filtered, std, xlims, ymin, ymax
+
+
+def fits2table(fits, start=None, end=None):
+    """Convert a DataFrame of Fit objects to numeric tables.
+
+    Return a fit table with (fit type, field) columns and a long format table
+    of filter bounds indexed by fit type, timestamp and bin edge number."""
+    tables = []
+    bounds = []
+    for fit_type in fits.columns:
+        vfits = fits[fit_type].values
+        params = fit.stack_params(vfits)
+        letters = list(PARAM_NAMES[:params.shape[1]])
+        n = len(letters)
+        cov = np.full((len(vfits), n*n), np.nan)
+        for i, vfit in enumerate(vfits):
+            if vfit.cov is not None and np.size(vfit.cov) == n*n:
+                cov[i] = np.ravel(vfit.cov)
+        table = pd.DataFrame(params, index=fits.index, columns=letters)
+        covcols = ['cov_' + p + q for p in letters for q in letters]
+        table = table.join(pd.DataFrame(cov, index=fits.index,
+                                        columns=covcols))
+        table['flipped'] = [bool(vfit.flipped) for vfit in vfits]
+        table['count'] = [vfit.point_count(filtered=False) for vfit in vfits]
+        table['count_filtered'] = [vfit.point_count() for vfit in vfits]
+        table['bounds_derived'] = [vfit.bounds_derived for vfit in vfits]
+        table['start'] = pd.NaT if start is None else start
+        table['end'] = pd.NaT if end is None else end
+        table.columns = pd.MultiIndex.from_product([[fit_type],
+                                                    table.columns])
+        tables.append(table)
+        for t, vfit in zip(fits.index, vfits):
+            if vfit.fltr_upper_x is None:
+                continue
+            stages = [(vfit, False)]
+            if vfit.prefilter is not None:
+                stages.append((vfit.prefilter, True))
+            for bfit, prefilter in stages:
+                if bfit.flipped:
+                    fltr = (bfit.fltr_lower_y, bfit.fltr_lower_x,
+                            bfit.fltr_upper_x)
+                else:
+                    fltr = (bfit.fltr_lower_x, bfit.fltr_lower_y,
+                            bfit.fltr_upper_y)
+                edges, lower, upper = [np.array(b, dtype=float) for b in fltr]
+                index = pd.MultiIndex.from_arrays([[fit_type]*edges.size,
+                                                   [t]*edges.size,
+                                                   np.arange(edges.size)],
+                                                  names=['fit', 'datetime',
+                                                         'i'])
+                bounds.append(pd.DataFrame({'edges': edges, 'lower': lower,
+                                            'upper': upper,
+                                            'prefilter': prefilter},
+                                           index=index))
+    table = pd.concat(tables, axis=1)
+    table.index = fits.index
+    if len(bounds) == 0:
+        return table, pd.DataFrame()
+    return table, pd.concat(bounds)
+
+
+def set_bounds(vfit, bounds):
+    """Set filter bounds of a fit from rows of a bounds table."""
+    edges, lower, upper = (bounds.edges.values, bounds.lower.values,
+                           bounds.upper.values)
+    if vfit.flipped:
+        vfit.fltr_lower_y = vfit.fltr_upper_y = edges
+        vfit.fltr_lower_x, vfit.fltr_upper_x = lower, upper
+    else:
+        vfit.fltr_lower_x = vfit.fltr_upper_x = edges
+        vfit.fltr_lower_y, vfit.fltr_upper_y = lower, upper
+
+
+def table2fits(table, bounds, data, xname='x', yname='y'):
+    """Rebuild a DataFrame of Fit objects from fit and filter bound tables.
+
+    Unfiltered data of each fit refers to data within its time span. Fits
+    whose points were not selected by the filter bounds, e.g. KDE peaks, are
+    rebuilt without data, keeping only their point counts."""
+    fits = pd.DataFrame(index=table.index)
+    for fit_type in table.columns.get_level_values(0).unique():
+        fitclass = fit.FIT_CLASSES[fit_type]
+        ftable = table[fit_type]
+        letters = [col for col in ftable.columns if col in list(PARAM_NAMES)]
+        n = len(letters)
+        covcols = ['cov_' + p + q for p in letters for q in letters]
+        if bounds.empty or fit_type not in bounds.index.get_level_values(0):
+            fbounds = {}
+        else:
+            fbounds = bounds.xs(fit_type, level='fit')
+            fbounds = dict(list(fbounds.groupby(level='datetime')))
+        vfits = []
+        for t, row in ftable.iterrows():
+            vfit = fitclass(flipped=bool(row['flipped']))
+            params = row[letters].values.astype(float)
+            if np.isfinite(params).all():
+                vfit.params = tuple(params)
+            cov = row[covcols].values.astype(float)
+            if np.isfinite(cov).all():
+                vfit.cov = cov.reshape(n, n)
+            if t in fbounds:
+                b = fbounds[t]
+                if 'prefilter' in b.columns:
+                    is_pre = b.prefilter.values.astype(bool)
+                    if is_pre.any():
+                        # D-binned filter applied before the flipped filter
+                        vfit.prefilter = fitclass()
+                        set_bounds(vfit.prefilter, b[is_pre])
+                    b = b[~is_pre]
+                set_bounds(vfit, b)
+            if not bool(row.get('bounds_derived', True)):
+                vfit.bounds_derived = False
+                vfit.n_points = (int(row['count']),
+                                 int(row['count_filtered']))
+            elif pd.notnull(row['start']) and pd.notnull(row['end']):
+                interval = data[row['start']:row['end']]
+                vfit.x_unfiltered = interval[xname].values
+                vfit.y_unfiltered = interval[yname].values
+            vfits.append(vfit)
+        fits[fit_type] = vfits
+    return fits
 
 
 class PipV(instruments.InstrumentData):
     """PIP particle velocity and diameter data handling"""
-    def __init__(self, filenames=None, dt_start=None, dt_end=None, **kwargs):
+    # Diameters and fall velocities stay in double precision, as they are
+    # compared to filter limits and bin edges. Other measurements are stored
+    # in single precision.
+    dtypes = {'Part_ID': np.int32,
+              'Wad_Dia': np.float64,
+              'd_voleq': np.float64,
+              'vel_v': np.float64,
+              'vel_h': np.float32}
+
+    def __init__(self, filenames=None, dt_start=None, dt_end=None,
+                 fit_processes=1, **kwargs):
         """Create a PipV object using data from a list of PIP velocity table
-        files."""
-        instruments.InstrumentData.__init__(self, filenames, **kwargs)
+        files.
+
+        fit_processes is the default number of worker processes in
+        find_fits."""
+        instruments.InstrumentData.__init__(self, filenames,
+                                            dt_start=dt_start,
+                                            dt_end=dt_end, **kwargs)
         self.name = 'pip_vel'
+        self.fit_processes = fit_processes
         self.dmin = 0.3   # shortest Wad_Dia where data is good
         self.dmax = 25.8
         self.vmin = 0.5
         self.d_col = 'd_voleq' # equivalent volume
         #self.d_col = 'Wad_Dia' # equivalent area
-        self._fits = pd.DataFrame()
+        self._fit_table = pd.DataFrame()
+        self._fit_bounds = pd.DataFrame()
+        self._fits_memo = None
         # num=511 --> binwidth 0.05
         if baecc.DEBUG:
             num = 103
@@ -89,68 +335,75 @@ class PipV(instruments.InstrumentData):
         self.default_fit = fit.PolFit
         self.flip = False
         self.loglog = True # use loglog method with power law fitting
-        if self.data.empty:
+        self.binned_kde = False # use FFT convolution of binned data in KDE
+        if self.data.empty and self.hdf_table is None:
             print('Reading PIP particle velocity data...')
-            for filename in filenames:
-                print('.', end='')
-                self.current_file = filename
-                if int(filename[-23:-15]) > 20141124:
-                    newdata = pd.read_csv(filename,
-                                          engine='python', sep='\t',
-                                          skipinitialspace=True, skiprows=8,
-                                          skip_footer=1,
-                                          parse_dates={'datetime':['minute_p']},
-                                          date_parser=self.parse_datetime,
-                                          verbose=baecc.DEBUG)
-                else:
-                    newdata = pd.read_csv(filename,
-                                          delim_whitespace=True,
-                                          skiprows=8,
-                                          parse_dates={'datetime':['minute_p']},
-                                          date_parser=self.parse_datetime,
-                                          verbose=baecc.DEBUG)
-                newdata = newdata[newdata['RecNum']>-99]
-                if not newdata.empty:
-                    newdata.rename_axis({'vel_v_1': 'vel_v',
-                                         'vel_h_1': 'vel_h',
-                                         'vel_v_2': 'vel_v',
-                                         'vel_h_2': 'vel_h'},
-                                        axis=1, inplace=True)
-                    newdata.set_index(['datetime', 'Part_ID', 'RecNum'],
-                                      inplace=True)
-                    g = newdata.groupby(level=['datetime', 'Part_ID'])
-                    newdata = g.mean()
-                    self.data = self.data.append(newdata)
+            frames = list(self.raw_frames(filenames, processes=self.processes))
             print()
-            if len(self.data.index):
-                self.data = self.data[self.data.vel_v.notnull()]
-            self.data.reset_index(level=1, inplace=True)
-            self.data = self.data.astype(float)
+            if len(frames):
+                self.data = pd.concat(frames)
         self.finish_init(dt_start, dt_end)
 
     @property
     def rule(self):
-        if self.fits.empty:
+        if self.fit_table.empty:
             return None
-        #return self.fits.index.freq.freqstr
-        return self.fits.index.freqstr
+        return self.fit_table.index.freqstr
 
     @property
     def binwidth(self):
         d = self.dbins
         return (d[-1]-d[0])/(len(d)-1)
 
+    @property
+    def fit_table(self):
+        """fit coefficients, covariances and particle counts"""
+        return self.store_read('fit_table', default_value=pd.DataFrame(),
+                               nocache_value=self._fit_table)
+
+    @fit_table.setter
+    def fit_table(self, table):
+        self._fits_memo = None
+        if self.use_cache:
+            self.store_write('fit_table', table)
+        else:
+            self._fit_table = table
+
+    @property
+    def fit_bounds(self):
+        """outlier filter bounds of fits"""
+        return self.store_read('fit_bounds', default_value=pd.DataFrame(),
+                               nocache_value=self._fit_bounds)
+
+    @fit_bounds.setter
+    def fit_bounds(self, bounds):
+        self._fits_memo = None
+        if self.use_cache:
+            self.store_write('fit_bounds', bounds)
+        else:
+            self._fit_bounds = bounds
+
     @property
     def fits(self):
-        return self.store_read('fits', default_value=pd.DataFrame(),
-                               nocache_value=self._fits)
+        """Fit objects rebuilt from the fit table
+
+        The rebuilt fits are memoized as long as the fingerprint and the fit
+        tables stay the same."""
+        key = (self.fingerprint(), self.d_col)
+        memo = getattr(self, '_fits_memo', None)
+        if memo is not None and memo[0] == key:
+            return memo[1]
+        table = self.fit_table
+        if table.empty:
+            return pd.DataFrame()
+        fits = table2fits(table, self.fit_bounds, self.good_data(),
+                          xname=self.d_col, yname='vel_v')
+        self._fits_memo = (key, fits)
+        return fits
 
     @fits.setter
     def fits(self, fits):
-        if self.use_cache:
-            self.store_write('fits', fits)
-        else:
-            self._fits = fits
+        self.fit_table, self.fit_bounds = fits2table(fits)
 
     @property
     def std(self):
@@ -182,43 +435,64 @@ class PipV(instruments.InstrumentData):
     def from_raw(cls, *args, subpath=SUBPATH, **kwargs):
         return super().from_raw(*args, subpath=subpath, **kwargs)
 
+    @classmethod
+    def read_file(cls, filename):
+        data = read_vel_table(filename)
+        if data.empty:
+            return data
+        data = data[data.vel_v.notnull()].reset_index(level=1)
+        return cls.compact(data)
+
+    @classmethod
+    def table_name(cls, filenames):
+        return 'pip_vel'
+
     def fingerprint(self):
-        identifiers = (super().fingerprint(), self.flip, self.dbins, self.loglog)
+        dbins = (self.dbins[0], self.dbins[-1], self.dbins.size)
+        identifiers = [super().fingerprint(), self.flip, dbins, self.loglog]
+        if self.binned_kde:
+            identifiers.append('binned_kde')
         idstr = caching.combine2str(*identifiers)
         return caching.fingerprint(idstr)
 
     def v(self, d, fitclass=None, varinterval=True, rule=None):
-        """velocities according to fits for given diameter"""
+        """velocities according to fits for given diameter
+
+        For an array of diameters, return the v(t, D) matrix as a DataFrame
+        with a column of velocities for each of them."""
         if fitclass is None:
             fitclass = self.default_fit
         if rule is None:
             rule = self.rule
-        if self.fits.empty:
-            self.find_fits(rule, fitclass=fitclass, varinterval=varinterval)
+        table = self.fit_table
+        if table.empty:
+            # fit_table, fit_bounds, std and hwfm are computed only once
+            self.store_compute('fit_table', self.find_fits, rule=rule,
+                               fitclass=fitclass, varinterval=varinterval)
+            table = self.fit_table
         elif not varinterval:
-            if pd.datetools.to_offset(rule) != self.fits.index.freq:
+            if pd.datetools.to_offset(rule) != table.index.freq:
                 print('different sampling freq')
                 self.find_fits(rule, fitclass=fitclass,
                                varinterval=varinterval)
-        v = []
-        for vfit in self.fits[fitclass.name].values:
-            v.append(vfit.func(d))
-        return pd.Series(v, index=self.fits.index, name='v')
+                table = self.fit_table
+        if fitclass in fit.STACKABLE_FITS:
+            params = self.fit_params(fitclass.name).values
+            flipped = table[fitclass.name]['flipped'].values
+            v = fit.stacked_func(fitclass, np.atleast_1d(d), params,
+                                 flipped=flipped)
+        else:
+            fits = self.fits[fitclass.name]
+            v = fit.evaluate_fits(fits.values, np.atleast_1d(d))
+        if np.ndim(d) > 0:
+            return pd.DataFrame(v, index=table.index, columns=d)
+        return pd.Series(v[:, 0], index=table.index, name='v')
 
     def lwc(self, rule='1min'):
         """liquid water content"""
-        d3 = self.good_data()[self.d_col]**3
+        d3 = self.good_data()[self.d_col].astype(float)**3
         return d3.resample(rule, how=np.sum, closed='right', label='right')
 
-    def parse_datetime(self, mm):
-        datestr = self.current_file.split('/')[-1].split('_')[0]
-        yr = int(datestr[3:7])
-        mo = int(datestr[7:9])
-        dd = int(datestr[9:11])
-        hh = int(datestr[11:13])
-        return datetime.datetime(yr, mo, dd, hh, int(mm))#,
-                                 #tzinfo=datetime.timezone.utc)
-
     def good_data(self):
         if self.stored_good_data is not None:
             return self.stored_good_data
@@ -252,8 +526,12 @@ class PipV(instruments.InstrumentData):
     def find_fit(self, fitclass=None, data=None, use_kde_peak=False,
                  cut_d=False, frac=0.5, use_curve_fit=True, bin_num_min=5,
                  filter_outliers=True, name=None, try_flip=None,
-                 plot_flip=False, force_flip=False, cut_kws={}, **kwargs):
-        """Find and store a fit for either raw data or kde."""
+                 plot_flip=False, force_flip=False, cut_kws={}, defer_fit=False,
+                 **kwargs):
+        """Find and store a fit for either raw data or kde.
+
+        With defer_fit, a plain curve fit is left without coefficients to be
+        solved later together with other intervals."""
         # TODO: clean this mess
         def too_few_particles(use_curve_fit, use_kde_peak):
             print('Too few particles.')
@@ -266,7 +544,7 @@ class PipV(instruments.InstrumentData):
             try_flip = True
         if data is None:
             data = self.good_data()
-        origdata = data.copy() # do not rewrite
+        origdata = data # filtering returns new frames
         if fitclass is None:
             fitclass = self.default_fit
         vfit = fitclass()
@@ -302,12 +580,13 @@ class PipV(instruments.InstrumentData):
         if use_kde_peak:
             d, v = self.kde_peak(data=data)
         else:
-            d = data[self.d_col].values
-            v = data.vel_v.values
+            d = data[self.d_col].values.astype(float)
+            v = data.vel_v.values.astype(float)
         if cut_d:
             dcut = self.d_cut(**cut_kws)
-            d = d[d < dcut]
-            v = v[d < dcut]
+            below = d < dcut
+            d = d[below]
+            v = v[below]
         if use_kde_peak:
             num = np.array([bindata(diam, self.binwidth, data=data,
                                     xname=self.d_col,
@@ -318,10 +597,15 @@ class PipV(instruments.InstrumentData):
                              yname='vel_v').vel_v.sem() for diam in d]
         else:
             sig = np.ones(d.size)
-        vfit.x = d
-        vfit.y = v
+        if use_kde_peak or cut_d:
+            vfit.x = d
+            vfit.y = v
+            vfit.bounds_derived = False
+        # otherwise filtered data is derived from filter bounds when needed
         vfit.x_unfiltered = origdata[self.d_col].values
         vfit.y_unfiltered = origdata.vel_v.values
+        if use_curve_fit and defer_fit and not (try_flip or use_kde_peak):
+            return vfit, std, hwfm
         if use_curve_fit:
             unflipped_kws = kwargs
             if self.default_fit.name == fit.PolFit.name:
@@ -337,6 +621,8 @@ class PipV(instruments.InstrumentData):
                 fiti.fltr_lower_y = xlimsi
                 fiti.fltr_upper_x = ymaxi + [ymaxi[-1]]
                 fiti.fltr_lower_x = ymini + [ymini[-1]]
+                # the flipped filter was applied to D-binned filtered data
+                fiti.prefilter = vfit.filter_bounds()
                 fiti.x = datai[self.d_col].values
                 fiti.y = datai.vel_v.values
                 fiti.x_unfiltered = origdata[self.d_col].values
@@ -386,20 +672,69 @@ class PipV(instruments.InstrumentData):
                                                        datedir)), fname))
         return axarr
 
-    def find_fits(self, rule, varinterval=True, empty_on_fail=True, **kwargs):
+    def find_fits(self, rule, varinterval=True, empty_on_fail=True,
+                  processes=None, batch_loglog=True, **kwargs):
+        """Find velocity fits for each time interval.
+
+        With processes > 1 the intervals are fitted in a process pool. With
+        batch_loglog, loglog power law fits of all intervals are solved at
+        once when possible."""
         print('Calculating velocity fits for given sampling frequency...')
+        if processes is None:
+            processes = getattr(self, 'fit_processes', 1)
+        fitclass = kwargs.get('fitclass')
+        if fitclass is None:
+            fitclass = self.default_fit
+        kwargs['defer_fit'] = (batch_loglog and self.loglog and not self.flip
+                               and fitclass.name == fit.PolFit.name
+                               and self.default_fit.name == fit.PolFit.name)
+        groups = self.grouped(rule=rule, varinterval=varinterval)
+        if processes > 1:
+            groups = list(groups)
+            worker_pipv = self.fitting_copy(keep_data=kwargs.get('cut_d'))
+            with Pool(processes, initializer=_init_fit_worker,
+                      initargs=(worker_pipv,)) as pool:
+                results = pool.map(_fit_worker, [(name, group, kwargs)
+                                                 for name, group in groups])
+            pairs = zip(groups, results)
+        else:
+            # groups are fitted one at a time as they are generated
+            pairs = (((name, group), _try_find_fit(self, name, group,
+                                                   **kwargs))
+                     for name, group in groups)
         names = []
+        start = []
+        end = []
+        counts = []
+        results = []
+        pending = [] # deferred fits waiting to be solved
+        for (name, group), result in pairs:
+            names.append(name)
+            start.append(group.index[0])
+            end.append(group.index[-1])
+            counts.append(group.vel_v.count())
+            results.append(result)
+            if isinstance(result, RuntimeError):
+                continue
+            if result[0].params is None:
+                # keep only fitted points until solved with other intervals
+                result[0].release_data(keep_fitted=True)
+                pending.append(len(results)-1)
+            else:
+                # fits are rebuilt from the fit table when needed
+                result[0].release_data()
+            if len(pending) >= DEFERRED_BATCH_SIZE:
+                self.solve_deferred_fits(results, counts, pending)
+                pending = []
+        del(groups, pairs)
+        self.solve_deferred_fits(results, counts, pending)
         fits = []
         stds = []
         hwfms = []
-        for name, group in self.grouped(rule=rule, varinterval=varinterval):
-            try:
-                newfit, std, hwfm = self.find_fit(data=group, name=name,
-                                                  try_flip=self.flip,
-                                                  **kwargs)
-            except RuntimeError as err:
-                print('%s: %s' % (name, err))
-                print('Particle count: %s' % group.vel_v.count())
+        for name, count, result in zip(names, counts, results):
+            if isinstance(result, RuntimeError):
+                print('%s: %s' % (name, result))
+                print('Particle count: %s' % count)
                 if len(fits) == 0 or empty_on_fail:
                     print('Using an empty fit')
                     newfit = self.default_fit()
@@ -410,8 +745,9 @@ class PipV(instruments.InstrumentData):
                     newfit = fits[-1]
                     std = stds[-1]
                     hwfm = hwfms[-1]
+            else:
+                newfit, std, hwfm = result
             fits.append(newfit)
-            names.append(name)
             stds.append(std)
             hwfms.append(hwfm)
         self.std = pd.concat(stds)
@@ -420,28 +756,76 @@ class PipV(instruments.InstrumentData):
             timestamps = names
         else:
             timestamps = pd.DatetimeIndex(names, freq=rule)
-        if self.fits.empty:
-            self.fits = pd.DataFrame(fits, index=timestamps,
-                                     columns=[newfit.name])
-        elif self.fits.index.equals(timestamps):
-            self.fits[newfit.name] = fits
-        else:
-            self.fits = pd.DataFrame(fits, index=timestamps,
-                                     columns=[newfit.name])
+        fits = pd.DataFrame(fits, index=timestamps, columns=[newfit.name])
+        table, bounds = fits2table(fits, start=start, end=end)
+        stored_table = self.fit_table
+        if not stored_table.empty and stored_table.index.equals(timestamps):
+            stored_table = stored_table.drop(newfit.name, axis=1, level=0,
+                                             errors='ignore')
+            table = pd.concat([stored_table, table], axis=1)
+            table.index = timestamps
+            stored_bounds = self.fit_bounds
+            if not stored_bounds.empty:
+                stored_bounds = stored_bounds.drop(newfit.name, level='fit',
+                                                   errors='ignore')
+                bounds = pd.concat([stored_bounds, bounds])
+        self.fit_table = table
+        self.fit_bounds = bounds
         return self.fits
 
+    def fitting_copy(self, keep_data=False):
+        """Return a copy with fitting settings only, e.g. for worker processes.
+
+        Data, cached tables and references to the case are left out unless
+        keep_data is set."""
+        pipv = copy.copy(self)
+        if not keep_data:
+            pipv.data = self.data.iloc[:0]
+            pipv.stored_good_data = None
+        pipv.parent = None
+        pipv.__dict__.pop('case', None)
+        pipv.use_cache = False
+        pipv._store_memo = {}
+        pipv._fit_table = pd.DataFrame()
+        pipv._fit_bounds = pd.DataFrame()
+        pipv._std = pd.DataFrame(columns=self.dbins)
+        pipv._hwfm = pd.DataFrame(columns=self.dbins)
+        return pipv
+
+    def solve_deferred_fits(self, results, counts, deferred):
+        """Solve deferred loglog power law fits of find_fit results in place.
+
+        counts are the particle counts of the intervals and deferred the
+        indices of results to solve. Solved fits release their data. Fits that
+        cannot be solved are replaced with RuntimeErrors."""
+        if len(deferred) == 0:
+            return results
+        vfits = [results[i][0] for i in deferred]
+        sizes = [vfit.x.size for vfit in vfits]
+        codes = np.repeat(np.arange(len(vfits)), sizes)
+        x = np.concatenate([vfit.x for vfit in vfits])
+        y = np.concatenate([vfit.y for vfit in vfits])
+        params, cov = fit.fit_loglog_batch(x, y, codes, n_groups=len(vfits))
+        for j, i in enumerate(deferred):
+            if not (np.isfinite(params[j]).all() and np.isfinite(cov[j]).all()):
+                results[i] = RuntimeError('Could not fit a power law.')
+                continue
+            vfit = vfits[j]
+            vfit.params = tuple(params[j])
+            vfit.cov = cov[j]
+            partcount = counts[i]
+            errstr = 'err: std ' + '{0:.4f}'.format(vfit.perr()[1])
+            print('standard fit: ' + str(vfit) + '; ' + str(partcount) + ' particles; ' + errstr)
+            vfit.release_data()
+        return results
+
     def fit_params(self, fit_type=None):
         """Return DataFrame of fit parameters."""
         if fit_type is None:
             fit_type = self.default_fit.name
-        letter = 'abcdef'
-        params = self.fits[fit_type].apply(lambda vfit: vfit.params)
-        paramlist = []
-        for i in range(len(params.values[0])):
-            param = params.apply(lambda p: p[i])
-            param.name = letter[i]
-            paramlist.append(param)
-        return baecc.merge_multiseries(*paramlist) # TODO: replace with concat
+        table = self.fit_table[fit_type]
+        return table[[col for col in table.columns
+                      if col in list(PARAM_NAMES)]]
 
     def partcount(self, rule, varinterval):
         return self.grouped(rule=rule, varinterval=varinterval).Part_ID.count()
@@ -465,10 +849,19 @@ class PipV(instruments.InstrumentData):
         return np.meshgrid(dbins, np.linspace(v.min(), v.max(), num_vbins))
 
     def kde_grid(self, data=None):
-        """Calculate kernel-density estimate with given resolution."""
+        """Calculate kernel-density estimate with given resolution.
+
+        If binned_kde is set, the estimate is calculated from particle
+        counts on the grid using the same bandwidth as the exact KDE."""
+        if data is None:
+            data = self.good_data()
         X, Y = self.grids(data)
-        points = np.vstack([X.ravel(), Y.ravel()])
         kernel = self.kde(data)
+        if self.binned_kde:
+            Z = kde_binned(data[self.d_col].values, data.vel_v.values,
+                           X[0, :], Y[:, 0], kernel.covariance)
+            return X, Y, Z
+        points = np.vstack([X.ravel(), Y.ravel()])
         Z = np.reshape(kernel(points).T, X.shape)
         return X, Y, Z
 
@@ -2,12 +2,10 @@
 from __future__ import absolute_import, division, print_function, unicode_literals
 __metaclass__ = type
 
-import time
-import os
 import numpy as np
 import pandas as pd
 from warnings import warn
-from datetime import datetime, timedelta
+from datetime import timedelta
 import baecc
 from baecc import instruments, caching
 
@@ -17,22 +15,59 @@ P400_SUBPATH = 'Pluvio400/pluvio400_??_%s*.txt'
 
 
 def parse_datetime(datestr, include_sec=False):
-    datestr = str(int(datestr))
-    t = time.strptime(datestr, '%Y%m%d%H%M%S')
-    if include_sec:
-        t_end = 6
-    else:
-        t_end = 5
-    #return datetime.datetime(*t[:t_end], tzinfo=datetime.timezone.utc)
-    return datetime(*t[:t_end])
+    """Parse an array of date strings. Unparseable ones are returned as NaT."""
+    t = pd.to_datetime(pd.Series(datestr).str.strip(),
+                       format='%Y%m%d%H%M%S', errors='coerce')
+    if not include_sec:
+        t = t.dt.floor('min')
+    return pd.DatetimeIndex(t)
+
+
+COL_ABBR = ['datestr',
+            'i_rt',
+            'acc_rt',
+            'acc_nrt',
+            'acc_tot_nrt',
+            'bucket_rt',
+            'bucket_nrt',
+            't_load',
+            'heating',
+            'status',
+            't_elec',
+            'volt',
+            't_rim']
+
+
+def read_pluvio_file(filename, names=COL_ABBR):
+    """Read a pluviometer data file, skipping bad lines."""
+    try:
+        data = pd.read_csv(filename, sep=';', names=names,
+                           dtype={'datestr': str, 'heating': float,
+                                  'status': float},
+                           skip_blank_lines=True,
+                           error_bad_lines=False,
+                           warn_bad_lines=True,
+                           verbose=baecc.DEBUG)
+    except NotImplementedError as err:
+        print('\n%s: %s' % (filename, format(err)))
+        return pd.DataFrame()
+    data.index = parse_datetime(data.pop('datestr').values)
+    data.index.name = 'datetime'
+    return data[data.index.notnull()]
 
 
 class Pluvio(instruments.InstrumentData, instruments.PrecipMeasurer):
     """Pluviometer data handling"""
+    span_buffer = timedelta(hours=2) # for timeshift
+    # same dtypes for every file, as files are appended to tables one by one
+    dtypes = {col: np.float64 for col in COL_ABBR[1:]}
     def __init__(self, filenames=[], dt_start=None, dt_end=None, name=None,
-                 **kwargs):
+                 hdf_table=None, **kwargs):
         """Create a Pluvio object using data from a list of files."""
-        instruments.InstrumentData.__init__(self, filenames, **kwargs)
+        instruments.InstrumentData.__init__(self, filenames,
+                                            hdf_table=hdf_table,
+                                            dt_start=dt_start, dt_end=dt_end,
+                                            **kwargs)
         self.bias = 0
         self._shift_periods = 0
         self._shift_freq = '1min'
@@ -44,7 +79,10 @@ class Pluvio(instruments.InstrumentData, instruments.PrecipMeasurer):
         self.amount_col = 'acc_' + col_suffix
         self.bucket_col = 'bucket_' + col_suffix
         self.maxdelta = timedelta(hours=1)
-        self.name = name.lower()
+        if name is not None:
+            self.name = name.lower()
+        elif hdf_table is None:
+            self.name = None
         self.col_description = ['date string',
                                 'intensity RT [mm h]',
                                 'accumulated RT/NRT [mm]',
@@ -58,50 +96,22 @@ class Pluvio(instruments.InstrumentData, instruments.PrecipMeasurer):
                                 'temperature electronics unit',
                                 'supply voltage',
                                 'ice rim temperature']
-        if self.data.empty:
+        if self.data.empty and self.hdf_table is None:
             if len(filenames)<1:
                 warn('No input files or data given.')
                 return
             print('Reading pluviometer data...')
             if self.name is None:
-                self.name = os.path.basename(os.path.dirname(self.filenames[0])).lower()
-            col_abbr = ['datestr',
-                        'i_rt',
-                        'acc_rt',
-                        'acc_nrt',
-                        'acc_tot_nrt',
-                        'bucket_rt',
-                        'bucket_nrt',
-                        't_load',
-                        'heating',
-                        'status',
-                        't_elec',
-                        'volt',
-                        't_rim']
-            for filename in filenames:
-                print('.', end='')
-                #num_lines = file_len(filename)
-                self.current_file = filename
-                try:
-                    newdata = pd.read_csv(filename, sep=';',
-                                          names=col_abbr,
-                                          parse_dates={'datetime':['datestr']},
-                                          date_parser=parse_datetime,
-                                          index_col='datetime',
-                                          skip_blank_lines=True,
-                                          error_bad_lines=False,
-                                          warn_bad_lines=True,
-                                          verbose=baecc.DEBUG)
-                    self.data = self.data.append(newdata)
-                except NotImplementedError as err:
-                    print('\n%s: %s' % (filename, format(err)))
+                self.name = self.table_name(self.filenames)
+            frames = list(self.raw_frames(filenames, processes=self.processes))
             print()
+            if len(frames):
+                self.data = pd.concat(frames)
             #self.data.drop(['i_rt'], 1, inplace=True) # crap format
         self.buffer = timedelta(0)
         self.finish_init(dt_start, dt_end)
-        self.data['group'] = self.data.acc_nrt.astype(bool).astype(int).cumsum().shift(1).fillna(0)
-        self.data['heating'] = self.data.heating.astype(float)  # sometimes this are interpreted as int
-        self.data['status'] = self.data.status.astype(float)   # sometimes this are interpreted as int
+        group = self.data.acc_nrt.astype(bool).astype(int).cumsum().shift(1)
+        self.data = self.data.assign(group=group.fillna(0))
 
     @property
     def varinterval(self):
@@ -136,9 +146,18 @@ class Pluvio(instruments.InstrumentData, instruments.PrecipMeasurer):
     def from_raw(cls, subpath=P200_SUBPATH, *args, **kwargs):
         return super().from_raw(*args, subpath=subpath, **kwargs)
 
+    @classmethod
+    def read_file(cls, filename):
+        return cls.compact(read_pluvio_file(filename))
+
+    @classmethod
+    def table_name(cls, filenames):
+        return super().table_name(filenames).lower()
+
     def fingerprint(self):
         identifiers = [super().fingerprint(), self.name, self.shift_periods,
-                       self.shift_freq, self.varinterval]
+                       self.shift_freq, self.varinterval, self.buffer,
+                       self.bias]
         if self.varinterval:
             identifiers.extend([self.n_combined_intervals])
         idstr = caching.combine2str(*identifiers)
@@ -169,10 +188,10 @@ class Pluvio(instruments.InstrumentData, instruments.PrecipMeasurer):
             return
         for dt in [dt_start, dt_end]:
             dt = pd.to_datetime(dt)
-        self.buffer = timedelta(hours=2)
+        self.buffer = self.span_buffer
         if dt_start is None or dt_end is None:
             self.buffer = timedelta(0)
-        elif dt_start-self.buffer < self.data.index[0] or dt_end+self.buffer > self.data.index[-1]:
+        elif self.data.empty or dt_start-self.buffer < self.data.index[0] or dt_end+self.buffer > self.data.index[-1]:
             self.buffer = timedelta(0)
         self.data = self.data[dt_start-self.buffer:dt_end+self.buffer]
 
@@ -9,8 +9,8 @@ import pandas as pd
 import bisect
 import baecc
 from os import path
-from baecc import RESULTS_DIR, DATA_DIR, USER_DIR, H5_PATH
-from baecc import caching
+from baecc import RESULTS_DIR, DATA_DIR, USER_DIR, H5_PATH, ARCHIVE_PATH
+from baecc import caching, storage
 from j24 import ensure_dir, ensure_join
 
 N_COMB_INTERVALS = 2
@@ -31,7 +31,9 @@ paths = {'results': ensure_dir(resultspath),
 files = {'h5nov14': path.join(DATA_DIR, '2014nov1-23.h5'),
          'h5w1415': path.join(DATA_DIR, 'dec-jan1415.h5'),
          'h5baecc': H5_PATH,
-         'params_cache': path.join(caching.CACHE_DIR, 'param_table'+ caching.MSGTLD)}
+         'archive': ARCHIVE_PATH,
+         'params_cache': caching.entry_path(path.join(caching.CACHE_DIR,
+                                                      'param_table'))}
 
 
 def cases_filepath(name):
@@ -86,16 +88,32 @@ def extra_events(e, extra_cases_file, extra_h5_file, *pluvio_conf_args):
     del(ee)
 
 
-def events(casesname_baecc=None, casesname_nov14=None, casesname_1415=None):
+def create_archive(sources=('h5nov14', 'h5w1415', 'h5baecc'), **kws):
+    """Copy the seasonal hdf files to the partitioned archive."""
+    for key in sources:
+        if path.isfile(files[key]):
+            storage.repartition(files[key], files['archive'], **kws)
+
+
+def events(casesname_baecc=None, casesname_nov14=None, casesname_1415=None,
+           use_archive=True):
+    """Events of all seasons, read from the partitioned archive by default.
+
+    The seasonal hdf files are used if the archive has not been created."""
+    catalog = path.join(files['archive'], storage.CATALOGFILE)
+    if use_archive and path.isfile(catalog):
+        h5baecc = h5w1415 = files['archive']
+    else:
+        h5baecc, h5w1415 = files['h5baecc'], files['h5w1415']
     casesfile_baecc = cases_filepath(casesname_baecc)
     e = baecc.events.EventsCollection(casesfile_baecc, dtformat_default)
-    e.autoimport_data(datafile=files['h5baecc'], autoshift=False, autobias=False,
+    e.autoimport_data(datafile=h5baecc, autoshift=False, autobias=False,
                       rule='6min', varinterval=True)
     pluvio_config(e, -6, N_COMB_INTERVALS)
     #extra_events(e, casesfile_nov14, files['h5nov14'], -5, N_COMB_INTERVALS)
     if casesname_1415 is not None:
         casesfile_1415 = cases_filepath(casesname_1415)
-        extra_events(e, casesfile_1415, files['h5w1415'], -5, N_COMB_INTERVALS)
+        extra_events(e, casesfile_1415, h5w1415, -5, N_COMB_INTERVALS)
     e.events['paper'] = e.events.pluvio200
     e.split_index()
     e.events = before_after_col(e.events, date=pd.datetime(2014,7,1),
@@ -110,7 +128,7 @@ def param_table(e=None, cond=cond, debug=False, rho_limits=None,
                 use_cache=True, split_date=pd.datetime(2014,7,1), **kws):
     cached_table = files['params_cache']
     if path.isfile(cached_table) and use_cache:
-        return pd.read_msgpack(cached_table)
+        return caching.read_entry(cached_table)
     if e is None:
         if debug:
             e = test_events(**kws)
@@ -0,0 +1,309 @@
+# coding: utf-8
+"""storage backends for instrument data archives"""
+import os
+import shutil
+import uuid
+import numpy as np
+import pandas as pd
+from os import path
+from glob import glob
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+    pq = None
+
+PARQUETTLD = '.parquet'
+CATALOGFILE = 'catalog.csv'
+CATALOG_COLS = ['table', 'day', 'rows', 't_start', 't_end']
+DAYFORMAT = '%Y%m%d'
+REPARTITION_CHUNKSIZE = 500000 # rows
+
+
+def span_where(dt_start=None, dt_end=None):
+    """hdf table query for rows within a time span"""
+    terms = []
+    if dt_start is not None:
+        terms.append('index >= \'{0}\''.format(pd.to_datetime(dt_start)))
+    if dt_end is not None:
+        terms.append('index <= \'{0}\''.format(pd.to_datetime(dt_end)))
+    if len(terms) == 0:
+        return None
+    return ' & '.join(terms)
+
+
+def span_mask(index, dt_start=None, dt_end=None):
+    """boolean mask of timestamps within a time span"""
+    mask = np.ones(len(index), dtype=bool)
+    if dt_start is not None:
+        mask &= index >= pd.to_datetime(dt_start)
+    if dt_end is not None:
+        mask &= index <= pd.to_datetime(dt_end)
+    return mask
+
+
+def cast_like(data, stored):
+    """Cast columns of data to the dtypes of the same columns in stored."""
+    schema = {col: dtype for col, dtype in stored.dtypes.items()
+              if col in data.columns and data[col].dtype != dtype}
+    if len(schema) == 0:
+        return data
+    return data.astype(schema)
+
+
+def backend(filename, **kwargs):
+    """Return storage backend for an archive based on its file extension.
+
+    Directories and new paths without extension are date-partitioned
+    archives, created on the first append. Existing files are hdf5."""
+    if filename.endswith(PARQUETTLD):
+        return ParquetBackend(filename, **kwargs)
+    if path.isdir(filename):
+        return PartitionedBackend(filename, **kwargs)
+    extensionless = path.splitext(filename.rstrip(os.sep))[1] == ''
+    if extensionless and not path.isfile(filename):
+        return PartitionedBackend(filename, **kwargs)
+    return HDFBackend(filename, **kwargs)
+
+
+def repartition(src, dst, tables=None, chunksize=REPARTITION_CHUNKSIZE,
+                **kwargs):
+    """Copy tables from a hdf file to a partitioned archive in chunks."""
+    archive = PartitionedBackend(dst, **kwargs)
+    with pd.HDFStore(src, mode='r') as store:
+        if tables is None:
+            tables = [key.lstrip('/') for key in store.keys()]
+        for table in tables:
+            for chunk in store.select(table, chunksize=chunksize):
+                archive.append(table, chunk)
+
+
+class HDFBackend:
+    """archive of time indexed tables in a single PyTables hdf5 file"""
+    def __init__(self, filename, complevel=None, complib=None):
+        self.filename = filename
+        self.complevel = complevel
+        self.complib = complib
+
+    def append(self, table, data):
+        """Append data to a table, cast to the dtypes of the stored table."""
+        if path.isfile(self.filename):
+            with pd.HDFStore(self.filename, mode='r') as store:
+                if table in store:
+                    data = cast_like(data, store.select(table, stop=0))
+        data.to_hdf(self.filename, key=table, format='table', append=True,
+                    index=True, complevel=self.complevel,
+                    complib=self.complib)
+
+    def read(self, table, dt_start=None, dt_end=None, columns=None):
+        """Read a table, optionally only a time span and given columns."""
+        return pd.read_hdf(self.filename, table,
+                           where=span_where(dt_start, dt_end),
+                           columns=columns)
+
+    def remove(self, table, dt_start=None, dt_end=None):
+        """Remove rows within a time span from a table."""
+        with pd.HDFStore(self.filename) as store:
+            if table in store:
+                store.remove(table, where=span_where(dt_start, dt_end))
+
+
+class ParquetBackend:
+    """archive of time indexed tables as directories of Parquet files
+
+    Each append is written as a separate file and removing rows rewrites every
+    file of the table, so this is meant for small archives only. Use
+    PartitionedBackend with partition_format='parquet' for large ones. Time
+    spans are selected using row group statistics of the time index, which is
+    stored as 'datetime' if unnamed."""
+    def __init__(self, filename, compression='snappy', row_group_size=None):
+        if pq is None:
+            raise ImportError('pyarrow is needed for Parquet archives.')
+        self.filename = filename
+        self.compression = compression
+        self.row_group_size = row_group_size
+
+    def table_dir(self, table):
+        return path.join(self.filename, table)
+
+    def table_files(self, table):
+        return sorted(glob(path.join(self.table_dir(table), '*' + PARQUETTLD)))
+
+    def append(self, table, data):
+        """Append data to a table, cast to the dtypes of the stored table."""
+        tabledir = self.table_dir(table)
+        if not path.isdir(tabledir):
+            os.makedirs(tabledir)
+        files = self.table_files(table)
+        if len(files) > 0:
+            stored = pq.read_schema(files[0]).empty_table().to_pandas()
+            data = cast_like(data, stored)
+        filename = path.join(tabledir, uuid.uuid4().hex + PARQUETTLD)
+        if data.index.name is None:
+            data = data.rename_axis('datetime')
+        pq.write_table(pa.Table.from_pandas(data), filename,
+                       compression=self.compression,
+                       row_group_size=self.row_group_size)
+
+    def read(self, table, dt_start=None, dt_end=None, columns=None):
+        """Read a table, optionally only a time span and given columns."""
+        files = self.table_files(table)
+        if len(files) == 0:
+            raise KeyError('No table {0} in {1}'.format(table, self.filename))
+        filters = []
+        if dt_start is not None:
+            filters.append(('datetime', '>=', pd.to_datetime(dt_start)))
+        if dt_end is not None:
+            filters.append(('datetime', '<=', pd.to_datetime(dt_end)))
+        data = pq.read_table(self.table_dir(table), columns=columns,
+                             filters=filters or None,
+                             use_pandas_metadata=True).to_pandas()
+        return data.sort_index()
+
+    def remove(self, table, dt_start=None, dt_end=None):
+        """Remove rows within a time span from a table."""
+        for filename in self.table_files(table):
+            data = pq.read_table(filename).to_pandas()
+            keep = ~span_mask(data.index, dt_start, dt_end)
+            if keep.all():
+                continue
+            if keep.any():
+                pq.write_table(pa.Table.from_pandas(data[keep]), filename,
+                               compression=self.compression,
+                               row_group_size=self.row_group_size)
+            else:
+                os.remove(filename)
+
+
+class PartitionedBackend:
+    """archive of time indexed tables partitioned by day
+
+    Each table has a directory with one hdf5 or Parquet partition per day. The
+    catalog lists the partitions and their time spans so that only the
+    partitions overlapping a requested span are opened."""
+    def __init__(self, filename, partition_format='h5', **kwargs):
+        self.filename = filename
+        self.partition_format = partition_format
+        self.kwargs = kwargs # passed to partition backends
+
+    def catalog_path(self):
+        return path.join(self.filename, CATALOGFILE)
+
+    def read_catalog(self):
+        """Read the catalog of partitions indexed by table and day."""
+        filename = self.catalog_path()
+        if not path.isfile(filename):
+            index = pd.MultiIndex.from_arrays([[], []], names=CATALOG_COLS[:2])
+            return pd.DataFrame(columns=CATALOG_COLS[2:], index=index)
+        return pd.read_csv(filename, index_col=[0, 1], dtype={'day': str},
+                           parse_dates=['t_start', 't_end'])
+
+    def write_catalog(self, catalog):
+        if not path.isdir(self.filename):
+            os.makedirs(self.filename)
+        catalog.sort_index().to_csv(self.catalog_path())
+
+    def partition_path(self, table, day):
+        return path.join(self.filename, table,
+                         day + os.extsep + self.partition_format.lstrip('.'))
+
+    def partition(self, table, day):
+        """storage backend of a single partition"""
+        return backend(self.partition_path(table, day), **self.kwargs)
+
+    def partitions(self, table, dt_start=None, dt_end=None, catalog=None):
+        """days of partitions of a table overlapping a time span"""
+        if catalog is None:
+            catalog = self.read_catalog()
+        if table not in catalog.index.get_level_values(0):
+            raise KeyError('No table {0} in {1}'.format(table, self.filename))
+        entries = catalog.xs(table, level=0)
+        overlap = np.ones(len(entries.index), dtype=bool)
+        if dt_start is not None:
+            overlap &= entries['t_end'] >= pd.to_datetime(dt_start)
+        if dt_end is not None:
+            overlap &= entries['t_start'] <= pd.to_datetime(dt_end)
+        return list(entries.index[overlap])
+
+    def drop_partition(self, table, day, catalog):
+        """Delete a partition and its catalog entry."""
+        filename = self.partition_path(table, day)
+        if path.isdir(filename):
+            shutil.rmtree(filename)
+        elif path.isfile(filename):
+            os.remove(filename)
+        if (table, day) in catalog.index:
+            catalog.drop((table, day), inplace=True)
+
+    def update_entry(self, table, day, catalog):
+        """Update the catalog entry of a partition from its contents."""
+        try:
+            data = self.partition(table, day).read(table)
+        except KeyError:
+            data = pd.DataFrame()
+        if data.empty:
+            self.drop_partition(table, day, catalog)
+            return
+        catalog.loc[(table, day), :] = [len(data.index), data.index.min(),
+                                        data.index.max()]
+
+    def append(self, table, data):
+        """Append data to a table, splitting it to daily partitions."""
+        catalog = self.read_catalog()
+        tabledir = path.join(self.filename, table)
+        if not path.isdir(tabledir):
+            os.makedirs(tabledir)
+        for day, daydata in data.groupby(data.index.normalize()):
+            day = day.strftime(DAYFORMAT)
+            self.partition(table, day).append(table, daydata)
+            entry = [len(daydata.index), daydata.index.min(),
+                     daydata.index.max()]
+            if (table, day) in catalog.index:
+                old = catalog.loc[(table, day)]
+                entry = [old['rows'] + entry[0], min(old['t_start'], entry[1]),
+                         max(old['t_end'], entry[2])]
+            catalog.loc[(table, day), :] = entry
+        self.write_catalog(catalog)
+
+    def read(self, table, dt_start=None, dt_end=None, columns=None):
+        """Read a table, optionally only a time span and given columns."""
+        catalog = self.read_catalog()
+        days = self.partitions(table, dt_start, dt_end, catalog=catalog)
+        if len(days) == 0:
+            # empty table with the right columns from any partition
+            day = catalog.xs(table, level=0).index[0]
+            return self.partition(table, day).read(table, dt_start, dt_end,
+                                                   columns=columns)
+        frames = [self.partition(table, day).read(table, dt_start, dt_end,
+                                                  columns=columns)
+                  for day in days]
+        return pd.concat(frames).sort_index()
+
+    def remove(self, table, dt_start=None, dt_end=None):
+        """Remove rows within a time span from a table."""
+        catalog = self.read_catalog()
+        try:
+            days = self.partitions(table, dt_start, dt_end, catalog=catalog)
+        except KeyError:
+            return
+        for day in days:
+            self.partition(table, day).remove(table, dt_start, dt_end)
+            self.update_entry(table, day, catalog)
+        self.write_catalog(catalog)
+
+    def write_partition(self, table, day, data):
+        """Rewrite a single daily partition of a table with data."""
+        day = pd.to_datetime(day).strftime(DAYFORMAT)
+        catalog = self.read_catalog()
+        self.drop_partition(table, day, catalog)
+        daydata = data[data.index.normalize() == pd.to_datetime(day)]
+        if not daydata.empty:
+            tabledir = path.join(self.filename, table)
+            if not path.isdir(tabledir):
+                os.makedirs(tabledir)
+            self.partition(table, day).append(table, daydata)
+            catalog.loc[(table, day), :] = [len(daydata.index),
+                                            daydata.index.min(),
+                                            daydata.index.max()]
+        self.write_catalog(catalog)
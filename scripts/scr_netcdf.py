@@ -36,7 +36,7 @@ for day in sf.daterange(date_start, date_end):
     dsd_is_empty = len(dsd_files) < 1
     if not dsd_is_empty:
         dsd = read.PipDSD(dsd_files)
-        dsd.data.drop_duplicates(inplace=True)
+        dsd.data = dsd.data.drop_duplicates()
     if not pipv_is_empty:
         pipv = read.PipV(pipv_files)
     
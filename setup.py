@@ -97,6 +97,7 @@ setup(
     extras_require={
         'dev': [],
         'test': [],
+        'parquet': ['pyarrow'],
     },
 
     # If there are data files included in your packages that need to be
@@ -116,5 +117,6 @@ setup(
     # "scripts" keyword. Entry points provide cross-platform support and allow
     # pip to create the appropriate form of executable for the target platform.
     entry_points={
+        'console_scripts': ['baecc-cache=baecc.caching:main'],
     },
 )